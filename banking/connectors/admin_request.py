@@ -1,8 +1,58 @@
 # Copyright (c) 2023, ALYF GmbH and contributors
 # For license information, please see license.txt
-import json
-from typing import Dict, Optional
+import os
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from banking.connectors.circuit_breaker import CircuitBreaker
+from banking.connectors.json_codec import dumps
+from banking.connectors.rate_limiter import RateLimiter
+from banking.connectors.retry import RetryPolicy
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = (5.0, 60.0)  # (connect, read) in seconds
+
+# Calls that don't create anything on the Admin app and can safely be sent again.
+# Consent calls are not among them: every response rotates the consent token, so a
+# resent request would use a token the Admin app may have spent already.
+IDEMPOTENT_METHODS = frozenset(
+	{
+		"banking_admin.api.fetch_accounts_and_bank",
+		"banking_admin.api.fetch_flow_transactions",
+		"banking_admin.api.end_session",
+		"banking_admin.api.fetch_subscription_details",
+		"banking_admin.api.get_customer_portal",
+	}
+)
+
+_sessions: Dict[Tuple[int, int], requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(pool_size: int = DEFAULT_POOL_SIZE) -> requests.Session:
+	"""
+	Return a keep-alive session that is shared by all requests of this worker process.
+
+	Sessions are keyed by PID, so that forked workers never share sockets with their parent.
+	"""
+	key = (os.getpid(), pool_size)
+	session = _sessions.get(key)
+	if session:
+		return session
+
+	with _sessions_lock:
+		session = _sessions.get(key)
+		if not session:
+			adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+			session = requests.Session()
+			session.mount("https://", adapter)
+			session.mount("http://", adapter)
+			_sessions[key] = session
+
+	return session
 
 
 class AdminRequest:
@@ -14,6 +64,11 @@ class AdminRequest:
 		url: str,
 		customer_id: str,
 		use_test_environment: bool,
+		pool_size: int = DEFAULT_POOL_SIZE,
+		timeout: Tuple[float, float] = DEFAULT_TIMEOUT,
+		retry_policy: Optional[RetryPolicy] = None,
+		rate_limiter: Optional[RateLimiter] = None,
+		circuit_breaker: Optional[CircuitBreaker] = None,
 	) -> None:
 		self.ip_address = ip_address
 		self.user_agent = user_agent
@@ -21,6 +76,11 @@ class AdminRequest:
 		self.url = url
 		self.customer_id = customer_id
 		self.use_test_environment = use_test_environment
+		self.timeout = timeout
+		self.session = get_session(pool_size)
+		self.retry_policy = retry_policy or RetryPolicy()
+		self.rate_limiter = rate_limiter
+		self.circuit_breaker = circuit_breaker
 
 	@property
 	def headers(self):
@@ -35,6 +95,40 @@ class AdminRequest:
 			"use_test_environment": self.use_test_environment,
 		}
 
+	def post(self, method: str, data: Dict, stream: bool = False) -> requests.Response:
+		return self.send(
+			lambda: self.session.post(
+				url=self.url + method,
+				headers=self.headers,
+				data=dumps(data),
+				timeout=self.timeout,
+				stream=stream,
+			),
+			idempotent=method in IDEMPOTENT_METHODS,
+		)
+
+	def send(
+		self, request: Callable[[], requests.Response], idempotent: bool = True
+	) -> requests.Response:
+		"""
+		Send the request through the circuit breaker, with retries.
+
+		The rate limiter is waited for before each attempt, retries included.
+		"""
+
+		def attempt():
+			if self.rate_limiter:
+				self.rate_limiter.acquire()
+			return request()
+
+		def attempt_with_retries():
+			return self.retry_policy.call(attempt, idempotent=idempotent)
+
+		if self.circuit_breaker:
+			return self.circuit_breaker.call(attempt_with_retries)
+
+		return attempt_with_retries()
+
 	def get_client_token(
 		self,
 		current_flow: str,
@@ -54,19 +148,13 @@ class AdminRequest:
 			}
 		)
 
-		method = "banking_admin.api.get_client_token"
-		return requests.post(
-			url=self.url + method, headers=self.headers, data=json.dumps(data)
-		)
+		return self.post("banking_admin.api.get_client_token", data)
 
 	def flow_accounts(self, session_id: str, flow_id: str):
 		data = self.data
 		data.update({"session_id": session_id, "flow_id": flow_id})
 
-		method = "banking_admin.api.fetch_accounts_and_bank"
-		return requests.post(
-			url=self.url + method, headers=self.headers, data=json.dumps(data)
-		)
+		return self.post("banking_admin.api.fetch_accounts_and_bank", data)
 
 	def flow_transactions(
 		self,
@@ -74,32 +162,26 @@ class AdminRequest:
 		flow_id: str,
 		url: Optional[str] = None,
 		offset: Optional[str] = None,
+		stream: bool = False,
 	):
 		data = self.data
 		data.update(
 			{"session_id": session_id, "flow_id": flow_id, "url": url, "offset": offset}
 		)
 
-		method = "banking_admin.api.fetch_flow_transactions"
-		return requests.post(
-			url=self.url + method, headers=self.headers, data=json.dumps(data)
-		)
+		return self.post("banking_admin.api.fetch_flow_transactions", data, stream)
 
 	def end_session(self, session_id: str):
 		data = self.data
 		data.update({"session_id": session_id})
 
-		method = "banking_admin.api.end_session"
-		requests.post(url=self.url + method, headers=self.headers, data=json.dumps(data))
+		self.post("banking_admin.api.end_session", data)
 
 	def consent_accounts(self, consent_id: str, consent_token: str):
 		data = self.data
 		data.update({"consent_id": consent_id, "consent_token": consent_token})
 
-		method = "banking_admin.api.fetch_consent_accounts"
-		return requests.post(
-			url=self.url + method, headers=self.headers, data=json.dumps(data)
-		)
+		return self.post("banking_admin.api.fetch_consent_accounts", data)
 
 	def consent_transactions(
 		self,
@@ -109,6 +191,7 @@ class AdminRequest:
 		consent_token: str,
 		url: Optional[str] = None,
 		offset: Optional[str] = None,
+		stream: bool = False,
 	):
 		data = self.data
 		data.update(
@@ -122,17 +205,11 @@ class AdminRequest:
 			}
 		)
 
-		method = "banking_admin.api.fetch_consent_transactions"
-		return requests.post(
-			url=self.url + method, headers=self.headers, data=json.dumps(data)
-		)
+		return self.post("banking_admin.api.fetch_consent_transactions", data, stream)
 
 	def fetch_subscription(self):
-		method = "banking_admin.api.fetch_subscription_details"
-		return requests.post(
-			url=self.url + method, headers=self.headers, data=json.dumps(self.data)
-		)
+		return self.post("banking_admin.api.fetch_subscription_details", self.data)
 
 	def get_customer_portal(self):
 		method = "banking_admin.api.get_customer_portal"
-		return requests.get(url=self.url + method)
+		return self.send(lambda: self.session.get(url=self.url + method, timeout=self.timeout))
@@ -1,9 +1,16 @@
 # Copyright (c) 2022, ALYF GmbH and contributors
 # For license information, please see license.txt
-from typing import Dict
+import codecs
+from typing import Dict, Iterator
 
+import requests
 from frappe.utils import formatdate, today
 
+from banking.connectors.json_codec import loads
+from banking.connectors.stream_decoder import StreamDecoder
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
 
 class AdminTransaction:
 	def __init__(self, response_value) -> None:
@@ -30,3 +37,56 @@ class AdminTransaction:
 		}
 
 		return payload
+
+
+class AdminTransactionStream(AdminTransaction):
+	"""
+	A page of transactions that is decoded while it is being downloaded.
+
+	Iterating yields the transactions one by one. The rest of the response
+	(`value`, `pagination`) is available once the iteration is done.
+	Responses that are not successful or not JSON are read at once.
+	"""
+
+	def __init__(self, response: requests.Response) -> None:
+		self.response = response
+		self.value, self.result, self.pagination = {}, {}, {}
+		self.transactions = self.decode()
+
+	@property
+	def transaction_list(self) -> Iterator[Dict]:
+		return self.transactions
+
+	def __iter__(self) -> Iterator[Dict]:
+		return self.transactions
+
+	def drain(self) -> None:
+		"""Read the rest of the page without processing it, e.g. after an error."""
+		for _ in self.transactions:
+			pass
+
+	def read(self) -> None:
+		"""
+		Download and decode the whole page now, so that `value` is complete before any
+		transaction is processed. Holds one page of transactions in memory.
+		"""
+		self.transactions = iter(list(self.transactions))
+
+	def decode(self) -> Iterator[Dict]:
+		is_json = "application/json" in self.response.headers.get("Content-Type", "")
+		if not (self.response.ok and is_json):
+			self.set_value(loads(self.response.content) if is_json else {})
+			return
+
+		decoder = StreamDecoder()
+		text_decoder = codecs.getincrementaldecoder("utf-8")()
+		for chunk in self.response.iter_content(STREAM_CHUNK_SIZE):
+			yield from decoder.feed(text_decoder.decode(chunk))
+
+		yield from decoder.feed(text_decoder.decode(b"", final=True))
+		self.set_value(decoder.close())
+
+	def set_value(self, response_value: Dict) -> None:
+		self.value = response_value.get("message", {})
+		self.result = self.value.get("result", {})
+		self.pagination = self.result.get("pagination", {})
@@ -0,0 +1,53 @@
+# Copyright (c) 2024, ALYF GmbH and contributors
+# For license information, please see license.txt
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Tuple
+
+import requests
+
+from banking.connectors.admin_request import AdminRequest
+from banking.connectors.json_codec import loads
+
+DEFAULT_CONCURRENCY = 4
+
+
+class AsyncAdminRequest:
+	"""
+	Awaitable wrapper around `AdminRequest`.
+
+	The blocking requests run in a bounded thread pool (sharing the pooled session), so
+	that many of them can be in flight at once. Responses are read and decoded in the
+	pool as well, the event loop's thread only gets the decoded value.
+	"""
+
+	def __init__(self, request: AdminRequest, concurrency: int = DEFAULT_CONCURRENCY) -> None:
+		self.request = request
+		self.semaphore = asyncio.Semaphore(concurrency)
+		self.executor = ThreadPoolExecutor(
+			max_workers=concurrency, thread_name_prefix="banking-admin"
+		)
+
+	async def __aenter__(self) -> "AsyncAdminRequest":
+		return self
+
+	async def __aexit__(self, *exc_info) -> None:
+		self.executor.shutdown(wait=True)
+
+	async def run(
+		self, call: Callable[..., requests.Response], *args
+	) -> Tuple[requests.Response, Dict]:
+		"""Send the request and decode its JSON body in a worker thread."""
+		async with self.semaphore:
+			loop = asyncio.get_running_loop()
+			return await loop.run_in_executor(self.executor, partial(decode, call, *args))
+
+	async def consent_accounts(self, consent_id: str, consent_token: str):
+		return await self.run(self.request.consent_accounts, consent_id, consent_token)
+
+
+def decode(call: Callable[..., requests.Response], *args) -> Tuple[requests.Response, Dict]:
+	response = call(*args)
+	is_json = "application/json" in response.headers.get("Content-Type", "")
+	return response, (loads(response.content) if is_json else {})
@@ -0,0 +1,54 @@
+# Copyright (c) 2024, ALYF GmbH and contributors
+# For license information, please see license.txt
+import hashlib
+import math
+from typing import Iterable, List
+
+DEFAULT_ERROR_RATE = 0.01
+
+
+class BloomFilter:
+	"""
+	Bit positions and membership checks of a Bloom filter stored as a Redis bitmap.
+
+	The bits are numbered like Redis' `SETBIT`/`GETBIT` (most significant bit of the
+	first byte first), so the filter can be updated in Redis bit by bit and checked
+	locally after a single `GET`.
+	"""
+
+	def __init__(self, size: int, error_rate: float = DEFAULT_ERROR_RATE) -> None:
+		self.size = size  # in bits, a multiple of 8
+		self.error_rate = error_rate
+		# Optimal for a filter that is filled up to its capacity, independent of the size
+		self.hashes = max(1, round(-math.log2(error_rate)))
+
+	@classmethod
+	def for_capacity(cls, capacity: int, error_rate: float = DEFAULT_ERROR_RATE) -> "BloomFilter":
+		"""Return the smallest filter that holds `capacity` items at the given error rate."""
+		size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+		return cls(max(8, math.ceil(size / 8) * 8), error_rate)
+
+	@property
+	def capacity(self) -> int:
+		"""Number of items this filter was sized for."""
+		return math.floor(-self.size * math.log(2) ** 2 / math.log(self.error_rate))
+
+	def positions(self, item: str) -> List[int]:
+		digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+		first, second = int.from_bytes(digest[:8], "big"), int.from_bytes(digest[8:], "big")
+		return [(first + i * second) % self.size for i in range(self.hashes)]
+
+	def to_bytes(self, items: Iterable[str]) -> bytes:
+		bits = bytearray(self.size // 8)
+		for item in items:
+			for position in self.positions(item):
+				bits[position >> 3] |= 0x80 >> (position & 7)
+
+		return bytes(bits)
+
+	def might_contain(self, bits: bytes, item: str) -> bool:
+		"""Whether `item` may be in the filter `bits`. If not, it is definitely not."""
+		return all(
+			position >> 3 < len(bits) and bits[position >> 3] & (0x80 >> (position & 7))
+			for position in self.positions(item)
+		)
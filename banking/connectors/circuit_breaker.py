@@ -0,0 +1,191 @@
+# Copyright (c) 2024, ALYF GmbH and contributors
+# For license information, please see license.txt
+import threading
+import time
+from typing import Callable, Dict, Tuple
+
+import requests
+
+KEY_PREFIX = "banking_admin_circuit|"
+
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_COOLDOWN = 60  # seconds
+
+# KEYS[1]: state hash, KEYS[2]: probe lock. ARGV: cooldown.
+# Returns {is_probe, seconds until the next probe} - the request may be sent if the latter is 0.
+BEFORE_REQUEST_SCRIPT = """
+local opened_at = tonumber(redis.call("HGET", KEYS[1], "opened_at"))
+if not opened_at then
+	return {0, "0"}
+end
+
+local time = redis.call("TIME")
+local retry_in = opened_at + tonumber(ARGV[1]) - tonumber(time[1])
+if retry_in > 0 then
+	return {0, tostring(retry_in)}
+end
+
+-- Half-open: only the first worker to get here sends a request
+if redis.call("SET", KEYS[2], 1, "NX", "EX", math.max(1, tonumber(ARGV[1]))) then
+	return {1, "0"}
+end
+return {0, ARGV[1]}
+"""
+
+# KEYS[1]: state hash, KEYS[2]: probe lock. ARGV: failure threshold, is_probe, cooldown.
+RECORD_FAILURE_SCRIPT = """
+local failures = redis.call("HINCRBY", KEYS[1], "failures", 1)
+if ARGV[2] == "1" or failures >= tonumber(ARGV[1]) then
+	redis.call("HSET", KEYS[1], "opened_at", redis.call("TIME")[1])
+	redis.call("DEL", KEYS[2])
+end
+-- Forget old failures once the Admin app was left alone for a while
+redis.call("EXPIRE", KEYS[1], 10 * tonumber(ARGV[3]))
+"""
+
+
+class CircuitOpenError(Exception):
+	"""The Admin app is considered down, the request was not sent."""
+
+	def __init__(self, retry_in: float) -> None:
+		self.retry_in = retry_in
+		super().__init__(f"Banking Admin is unavailable, retry in {retry_in:.0f} seconds")
+
+
+class LocalCircuitState:
+	"""In-process circuit state, used if Redis is not available."""
+
+	def __init__(self, clock: Callable[[], float] = time.time) -> None:
+		self.clock = clock
+		self.failures = 0
+		self.opened_at = None
+		self.probing = False
+		self._lock = threading.Lock()
+
+	def before_request(self, cooldown: float) -> Tuple[bool, float]:
+		with self._lock:
+			if self.opened_at is None:
+				return False, 0.0
+
+			retry_in = self.opened_at + cooldown - self.clock()
+			if retry_in > 0:
+				return False, retry_in
+
+			if not self.probing:
+				self.probing = True
+				return True, 0.0
+
+			return False, cooldown
+
+	def record_failure(self, failure_threshold: int, is_probe: bool, cooldown: float) -> None:
+		with self._lock:
+			self.failures += 1
+			if is_probe or self.failures >= failure_threshold:
+				self.opened_at = self.clock()
+				self.probing = False
+
+	def record_success(self) -> None:
+		with self._lock:
+			self.failures, self.opened_at, self.probing = 0, None, False
+
+
+class RedisCircuitState:
+	"""Circuit state shared by all workers that use the same Redis."""
+
+	def __init__(self, redis, key: str) -> None:
+		self.redis = redis
+		self.keys = (key, key + "|probe")
+
+	def before_request(self, cooldown: float) -> Tuple[bool, float]:
+		is_probe, retry_in = self.redis.eval(BEFORE_REQUEST_SCRIPT, 2, *self.keys, int(cooldown))
+		return bool(is_probe), float(retry_in)
+
+	def record_failure(self, failure_threshold: int, is_probe: bool, cooldown: float) -> None:
+		self.redis.eval(
+			RECORD_FAILURE_SCRIPT,
+			2,
+			*self.keys,
+			failure_threshold,
+			int(is_probe),
+			int(cooldown),
+		)
+
+	def record_success(self) -> None:
+		self.redis.eval("redis.call('DEL', KEYS[1], KEYS[2])", 2, *self.keys)
+
+
+# Fallback states per key, shared by all threads of this worker process
+_local_states: Dict[str, LocalCircuitState] = {}
+_local_states_lock = threading.Lock()
+
+
+def get_local_state(key: str) -> LocalCircuitState:
+	with _local_states_lock:
+		return _local_states.setdefault(key, LocalCircuitState())
+
+
+class CircuitBreaker:
+	"""
+	Stop sending requests to the Admin app after `failure_threshold` consecutive failures.
+
+	While the circuit is open, requests fail immediately with `CircuitOpenError`. After
+	`cooldown` seconds, a single request (of any worker) is let through as a probe: if it
+	succeeds, the circuit closes, otherwise it stays open for another cooldown.
+
+	The state is kept in Redis and shared by all workers. If Redis is not reachable,
+	each worker process keeps its own state.
+	"""
+
+	def __init__(
+		self,
+		key: str,
+		redis=None,
+		failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+		cooldown: float = DEFAULT_COOLDOWN,
+	) -> None:
+		self.key = KEY_PREFIX + key
+		# The connection is passed in as background threads have no frappe.local
+		self.state = RedisCircuitState(redis, self.key) if redis is not None else None
+		self.failure_threshold = failure_threshold
+		self.cooldown = cooldown
+
+	def call(self, send: Callable[[], requests.Response]) -> requests.Response:
+		is_probe = self.before_request()
+		try:
+			response = send()
+		except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+			self.update("record_failure", self.failure_threshold, is_probe, self.cooldown)
+			raise
+		except Exception:
+			# Says nothing about the Admin app, but a probe must not stay in flight forever
+			if is_probe:
+				self.update("record_failure", self.failure_threshold, is_probe, self.cooldown)
+			raise
+
+		if self.is_failure(response):
+			self.update("record_failure", self.failure_threshold, is_probe, self.cooldown)
+		else:
+			self.update("record_success")
+
+		return response
+
+	def before_request(self) -> bool:
+		"""Raise `CircuitOpenError` if the request must not be sent. Return whether it is a probe."""
+		is_probe, retry_in = self.update("before_request", self.cooldown)
+		if retry_in > 0:
+			raise CircuitOpenError(retry_in)
+
+		return is_probe
+
+	def update(self, method: str, *args):
+		if self.state:
+			try:
+				return getattr(self.state, method)(*args)
+			except Exception:
+				pass  # Redis unavailable, track this worker only
+
+		return getattr(get_local_state(self.key), method)(*args)
+
+	@staticmethod
+	def is_failure(response: requests.Response) -> bool:
+		return response.status_code >= 500
@@ -0,0 +1,35 @@
+# Copyright (c) 2024, ALYF GmbH and contributors
+# For license information, please see license.txt
+"""
+JSON encoding and decoding for Admin API traffic.
+
+Uses `orjson` (a dependency of recent Frappe versions) when it is installed
+and falls back to the standard library otherwise.
+
+This covers request bodies and responses, including the items of streamed pages, which
+`StreamDecoder` decodes in batches.
+"""
+import json
+from typing import Any, Union
+
+try:
+	import orjson
+except ImportError:
+	orjson = None
+
+
+def dumps(obj: Any) -> Union[str, bytes]:
+	if orjson:
+		try:
+			return orjson.dumps(obj)
+		except TypeError:
+			pass  # e.g. non-string keys or types orjson doesn't know
+
+	return json.dumps(obj)
+
+
+def loads(data: Union[str, bytes]) -> Any:
+	if orjson:
+		return orjson.loads(data)
+
+	return json.loads(data)
@@ -0,0 +1,171 @@
+# Copyright (c) 2024, ALYF GmbH and contributors
+# For license information, please see license.txt
+import queue
+import threading
+from contextlib import suppress
+from typing import Callable, Iterator, List, Optional
+
+PREFETCH_PAGES = 1
+# Items downloaded ahead of the consumer. The download waits when it is that far ahead,
+# so a page is never held in memory as a whole, however slow inserting is.
+PREFETCH_ITEMS = 500
+
+_END = object()
+
+
+class _Failure:
+	def __init__(self, exception: BaseException) -> None:
+		self.exception = exception
+
+
+class PrefetchedPage:
+	"""
+	A page that is downloaded on a background thread.
+
+	Iterating yields the page's items as soon as they arrive. All other attributes
+	(`response`, `value`, `pagination`, ...) are those of the wrapped page and are
+	complete once the iteration is done. At most `buffer_size` items are buffered.
+	"""
+
+	def __init__(self, page, buffer_size: int = PREFETCH_ITEMS) -> None:
+		self.page = page
+		self.items = queue.Queue(maxsize=buffer_size)
+		self.transactions = self.read()
+
+	def __getattr__(self, name: str):
+		return getattr(self.page, name)
+
+	@property
+	def transaction_list(self) -> Iterator:
+		return self.transactions
+
+	def __iter__(self) -> Iterator:
+		return self.transactions
+
+	def drain(self) -> None:
+		"""Wait for the rest of the page without processing it, e.g. after an error."""
+		for _ in self.transactions:
+			pass
+
+	def read(self) -> Iterator:
+		while True:
+			item = self.items.get()
+			if item is _END:
+				return
+			if isinstance(item, _Failure):
+				raise item.exception
+
+			yield item
+
+	def fill(self) -> bool:
+		"""Download the page into the queue (background thread). Return whether it succeeded."""
+		try:
+			for item in self.page:
+				self.items.put(item)
+		except Exception as exc:
+			self.items.put(_Failure(exc))
+			return False
+
+		self.items.put(_END)
+		return True
+
+
+class PagePipeline:
+	"""
+	Download the pages of a paginated request ahead of the consumer.
+
+	`fetch_next` is called on a background thread with the previous page (`None` for the
+	first one) and returns the next page or `None` when there is none. It must not use the
+	database. At most `depth` pages are downloaded ahead of the one being consumed, and
+	at most `buffer_size` items per page ahead of the consumer.
+
+	Call `close` when done: it stops prefetching and returns the pages that were fetched
+	but not consumed, fully downloaded.
+	"""
+
+	def __init__(
+		self,
+		fetch_next: Callable[[Optional[object]], Optional[object]],
+		depth: int = PREFETCH_PAGES,
+		buffer_size: int = PREFETCH_ITEMS,
+	) -> None:
+		self.fetch_next = fetch_next
+		self.buffer_size = buffer_size
+		self.current = None
+		self.pages = queue.SimpleQueue()
+		self.slots = threading.Semaphore(depth)
+		self.stopped = threading.Event()
+		self.finished = False
+		self.thread = threading.Thread(target=self.produce, name="banking-prefetch", daemon=True)
+
+	def start(self) -> "PagePipeline":
+		self.thread.start()
+		return self
+
+	def __iter__(self) -> Iterator[PrefetchedPage]:
+		while True:
+			item = self.get()
+			if item is None:
+				return
+			if isinstance(item, _Failure):
+				raise item.exception
+
+			yield item
+
+	def get(self):
+		if self.finished:
+			return None
+
+		item = self.pages.get()
+		if item is None:
+			self.finished = True
+		else:
+			# The consumer moved on to this page, the producer may fetch another one
+			self.slots.release()
+			if isinstance(item, PrefetchedPage):
+				self.current = item
+
+		return item
+
+	def produce(self) -> None:
+		page = None
+		try:
+			while True:
+				self.slots.acquire()
+				if self.stopped.is_set():
+					break
+
+				page = self.fetch_next(page)
+				if page is None:
+					break
+
+				page = PrefetchedPage(page, self.buffer_size)
+				self.pages.put(page)
+				if not page.fill():
+					break
+		except Exception as exc:
+			self.pages.put(_Failure(exc))
+		finally:
+			self.pages.put(None)
+
+	def close(self) -> List[PrefetchedPage]:
+		self.stopped.set()
+		self.slots.release()
+
+		if self.current:
+			# The download of an abandoned page would wait for the consumer forever
+			with suppress(Exception):
+				self.current.drain()
+
+		leftover = []
+		while True:
+			item = self.get()
+			if item is None:
+				break
+			if isinstance(item, PrefetchedPage):
+				with suppress(Exception):
+					item.drain()
+				leftover.append(item)
+
+		self.thread.join()
+		return leftover
@@ -0,0 +1,109 @@
+# Copyright (c) 2024, ALYF GmbH and contributors
+# For license information, please see license.txt
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+KEY_PREFIX = "banking_admin_rate_limit|"
+
+# Reserve a token in the bucket stored at KEYS[1] and return the seconds to wait for it.
+# The token count may drop below zero: every caller reserves the next free slot, so
+# concurrent callers are spaced out instead of retrying in lockstep.
+RESERVE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated")
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate) - 1
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "updated", tostring(now))
+redis.call("EXPIRE", KEYS[1], math.ceil((capacity - tokens) / rate) + 1)
+
+if tokens >= 0 then
+	return "0"
+end
+return tostring(-tokens / rate)
+"""
+
+
+class TokenBucket:
+	"""In-process token bucket, used if Redis is not available."""
+
+	def __init__(
+		self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic
+	) -> None:
+		self.rate = rate
+		self.capacity = capacity
+		self.clock = clock
+		self.tokens = capacity
+		self.updated = clock()
+		self._lock = threading.Lock()
+
+	def reserve(self) -> float:
+		"""Reserve a token and return the seconds to wait for it."""
+		with self._lock:
+			now = self.clock()
+			elapsed = max(0.0, now - self.updated)
+			self.tokens = min(self.capacity, self.tokens + elapsed * self.rate) - 1
+			self.updated = now
+			return max(0.0, -self.tokens / self.rate)
+
+
+# Fallback buckets per key, shared by all threads of this worker process
+_local_buckets: Dict[str, TokenBucket] = {}
+_local_buckets_lock = threading.Lock()
+
+
+def get_local_bucket(key: str, rate: float, capacity: float) -> TokenBucket:
+	with _local_buckets_lock:
+		bucket = _local_buckets.get(key)
+		if not bucket or (bucket.rate, bucket.capacity) != (rate, capacity):
+			bucket = _local_buckets[key] = TokenBucket(rate, capacity)
+
+		return bucket
+
+
+class RateLimiter:
+	"""
+	Limit the requests per second to the Admin app for one customer, across all workers.
+
+	The bucket lives in Redis, so that all workers of all benches using the same Redis
+	share it. Up to `burst` requests are let through at once, the rest are spread evenly.
+	If Redis is not reachable, each worker process limits itself.
+	"""
+
+	def __init__(
+		self,
+		rate: float,
+		key: str,
+		redis=None,
+		burst: Optional[float] = None,
+		sleep: Callable[[float], None] = time.sleep,
+	) -> None:
+		self.rate = rate
+		self.capacity = burst or max(1.0, rate)
+		self.key = KEY_PREFIX + key
+		# The connection is passed in as background threads have no frappe.local
+		self.redis = redis
+		self.sleep = sleep
+
+	def acquire(self) -> None:
+		"""Block until the next request may be sent."""
+		delay = self.reserve()
+		if delay > 0:
+			self.sleep(delay)
+
+	def reserve(self) -> float:
+		if self.redis is not None:
+			try:
+				return float(
+					self.redis.eval(RESERVE_SCRIPT, 1, self.key, self.rate, self.capacity)
+				)
+			except Exception:
+				pass  # Redis unavailable, limit this worker only
+
+		return get_local_bucket(self.key, self.rate, self.capacity).reserve()
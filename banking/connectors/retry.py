@@ -0,0 +1,154 @@
+# Copyright (c) 2024, ALYF GmbH and contributors
+# For license information, please see license.txt
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Optional
+
+import requests
+from urllib3.exceptions import NewConnectionError
+
+# Statuses that are raised by the gateway or rate limiter in front of the Admin app,
+# i.e. the request was either not processed or can safely be sent again.
+RETRY_STATUS_CODES = frozenset({429, 502, 503, 504})
+
+# Rejected before processing, safe to retry even for calls that are not idempotent.
+# 503 only counts if it comes with `Retry-After`, i.e. from a deliberate rejection.
+REJECTED_STATUS_CODES = frozenset({429})
+REJECTED_WITH_RETRY_AFTER_STATUS_CODES = frozenset({503})
+
+
+class RetryBudget:
+	"""Caps the number of retries that all requests of one sync may spend together."""
+
+	def __init__(self, total: int) -> None:
+		self.remaining = total
+		self._lock = threading.Lock()
+
+	def consume(self) -> bool:
+		with self._lock:
+			if self.remaining <= 0:
+				return False
+
+			self.remaining -= 1
+			return True
+
+
+class RetryPolicy:
+	"""
+	Retry transient failures with jittered exponential backoff, honouring `Retry-After`.
+
+	Calls that are not idempotent are only retried if the request was never processed
+	by the Admin app (connect errors, 429, 503 with `Retry-After`).
+	"""
+
+	def __init__(
+		self,
+		max_retries: int = 3,
+		backoff_factor: float = 0.5,
+		max_backoff: float = 30.0,
+		max_retry_after: float = 120.0,
+		budget: Optional[RetryBudget] = None,
+		sleep: Callable[[float], None] = time.sleep,
+	) -> None:
+		self.max_retries = max_retries
+		self.backoff_factor = backoff_factor
+		self.max_backoff = max_backoff
+		self.max_retry_after = max_retry_after
+		self.budget = budget
+		self.sleep = sleep
+
+	def call(
+		self, send: Callable[[], requests.Response], idempotent: bool = True
+	) -> requests.Response:
+		attempt = 0
+		while True:
+			try:
+				response = send()
+			except requests.exceptions.RequestException as exc:
+				if not (self.is_retryable_error(exc, idempotent) and self.can_retry(attempt)):
+					raise
+
+				self.sleep(self.get_backoff(attempt))
+				attempt += 1
+				continue
+
+			if not (self.is_retryable_response(response, idempotent) and self.can_retry(attempt)):
+				return response
+
+			delay = self.get_retry_after(response)
+			if delay is None:
+				delay = self.get_backoff(attempt)
+			elif delay > self.max_retry_after:
+				return response  # don't block the worker, let the caller handle it
+
+			response.close()
+			self.sleep(delay)
+			attempt += 1
+
+	def can_retry(self, attempt: int) -> bool:
+		if attempt >= self.max_retries:
+			return False
+
+		return self.budget.consume() if self.budget else True
+
+	def get_backoff(self, attempt: int) -> float:
+		"""Full jitter: a random delay between 0 and the exponential backoff."""
+		return random.uniform(0, min(self.max_backoff, self.backoff_factor * 2**attempt))
+
+	@staticmethod
+	def is_retryable_error(exc: Exception, idempotent: bool) -> bool:
+		if is_connect_error(exc):
+			return True  # request was never sent
+
+		return idempotent and isinstance(
+			exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+		)
+
+	@staticmethod
+	def is_retryable_response(response: requests.Response, idempotent: bool) -> bool:
+		if idempotent:
+			return response.status_code in RETRY_STATUS_CODES
+
+		if response.status_code in REJECTED_WITH_RETRY_AFTER_STATUS_CODES:
+			return bool(response.headers.get("Retry-After"))
+
+		return response.status_code in REJECTED_STATUS_CODES
+
+	@staticmethod
+	def get_retry_after(response: requests.Response) -> Optional[float]:
+		"""Return the delay requested via `Retry-After` (seconds or HTTP date) in seconds."""
+		retry_after = response.headers.get("Retry-After")
+		if not retry_after:
+			return None
+
+		try:
+			return max(float(retry_after), 0.0)
+		except ValueError:
+			pass
+
+		try:
+			retry_at = parsedate_to_datetime(retry_after)
+		except (TypeError, ValueError):
+			return None
+
+		if retry_at.tzinfo is None:
+			retry_at = retry_at.replace(tzinfo=timezone.utc)
+
+		return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def is_connect_error(exc: Exception) -> bool:
+	"""Whether the connection could not be established, i.e. nothing was sent."""
+	if isinstance(exc, requests.exceptions.ConnectTimeout):
+		return True
+
+	if not isinstance(exc, requests.exceptions.ConnectionError):
+		return False
+
+	# requests wraps urllib3's MaxRetryError, whose reason is the actual error
+	reason = exc.args[0] if exc.args else None
+	reason = getattr(reason, "reason", reason)
+	return isinstance(reason, NewConnectionError)
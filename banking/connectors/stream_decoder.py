@@ -0,0 +1,175 @@
+# Copyright (c) 2024, ALYF GmbH and contributors
+# For license information, please see license.txt
+import json
+import re
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from banking.connectors.json_codec import loads
+
+PREFIX, ITEMS, SUFFIX = range(3)
+WHITESPACE = " \t\n\r"
+# A "}" that ends an item of the streamed array: followed by the next item or the array's end
+ITEM_END = re.compile(r"\}[ \t\n\r]*(?:,[ \t\n\r]*\{|\])")
+MAX_BATCH_TRIES = 3
+
+
+class StreamDecoder:
+	"""
+	Incrementally decode one JSON document, yielding the items of one of its arrays
+	as soon as they are complete.
+
+	Everything except the streamed array (e.g. pagination, consent token) is kept as the
+	document's "envelope", which is available after `close()`, with the array left empty.
+	Only the current chunk is ever buffered, so memory use does not grow with the array.
+	The complete items of a chunk are decoded with one call of the fast JSON codec.
+	"""
+
+	def __init__(self, path: Sequence[str] = ("message", "result", "transactions")) -> None:
+		self.path = list(path)
+		self.phase = PREFIX
+		self.buffer = ""
+		self.pos = 0
+		self.envelope_parts: List[str] = []
+
+		# prefix scanner state
+		self.keys: List[Optional[str]] = []  # key of each open container
+		self.in_string = False
+		self.escaped = False
+		self.string_start = 0
+		self.last_string: Optional[str] = None
+		self.current_key: Optional[str] = None
+
+		# For items that can't be decoded in a batch, `raw_decode` finds their end
+		self.decoder = json.JSONDecoder()
+
+	def feed(self, text: str) -> Iterator[Dict]:
+		"""Add the next chunk of the document and yield the items it completes."""
+		self.buffer += text
+		if self.phase == PREFIX:
+			self.scan_prefix()
+		if self.phase == ITEMS:
+			yield from self.decode_items()
+		if self.phase == SUFFIX:
+			self.envelope_parts.append(self.buffer[self.pos :])
+			self.buffer, self.pos = "", 0
+
+	def close(self) -> Dict:
+		"""Return the envelope, once the whole document has been fed."""
+		if self.phase == ITEMS:
+			raise ValueError("Incomplete JSON document: streamed array is not closed")
+
+		self.envelope_parts.append(self.buffer[self.pos :])
+		self.buffer, self.pos = "", 0
+
+		document = "".join(self.envelope_parts).strip()
+		return loads(document) if document else {}
+
+	def scan_prefix(self) -> None:
+		"""Walk the document up to the opening bracket of the streamed array."""
+		buffer = self.buffer
+		for pos in range(self.pos, len(buffer)):
+			char = buffer[pos]
+
+			if self.in_string:
+				if self.escaped:
+					self.escaped = False
+				elif char == "\\":
+					self.escaped = True
+				elif char == '"':
+					self.in_string = False
+					self.last_string = json.loads(buffer[self.string_start : pos + 1])
+				continue
+
+			if char == '"':
+				self.in_string = True
+				self.string_start = pos
+			elif char == ":":
+				self.current_key = self.last_string
+			elif char in "{[":
+				if char == "[" and self.is_streamed_array():
+					self.envelope_parts.append(buffer[: pos + 1])
+					self.buffer, self.pos = buffer[pos + 1 :], 0
+					self.phase = ITEMS
+					return
+
+				self.keys.append(self.current_key)
+				self.current_key = None
+			elif char in "}]":
+				self.keys.pop()
+			elif char == ",":
+				self.current_key = None
+
+		# keep the unfinished string so that it can be parsed once complete
+		keep_from = self.string_start if self.in_string else len(buffer)
+		self.envelope_parts.append(buffer[:keep_from])
+		self.buffer = buffer[keep_from:]
+		self.string_start -= keep_from
+		self.pos = len(self.buffer)
+
+	def is_streamed_array(self) -> bool:
+		return self.keys[1:] == self.path[:-1] and self.current_key == self.path[-1]
+
+	def decode_items(self) -> Iterator[Dict]:
+		buffer, pos = self.buffer, self.pos
+		while True:
+			pos = skip_whitespace(buffer, pos)
+			if pos >= len(buffer):
+				break
+
+			if buffer[pos] == ",":
+				pos += 1
+				continue
+
+			if buffer[pos] == "]":
+				self.phase = SUFFIX
+				break
+
+			items, end = decode_batch(buffer, pos)
+			if items is not None:
+				pos = end
+				yield from items
+				continue
+
+			try:
+				item, end = self.decoder.raw_decode(buffer, pos)
+			except json.JSONDecodeError:
+				break  # item is incomplete, wait for the next chunk
+
+			pos = end
+			yield item
+
+		# drop what has been consumed, so that the buffer only holds the current item
+		self.buffer, self.pos = buffer[pos:], 0
+
+
+def decode_batch(text: str, pos: int) -> Tuple[Optional[List], int]:
+	"""
+	Decode the complete items from `pos` on, in one go. Return them and the position after
+	the last one, or None if the end of an item can't be told apart (e.g. "},{" in a string).
+	"""
+	end = len(text)
+	for _ in range(MAX_BATCH_TRIES):
+		end = find_item_end(text, pos, end)
+		if end < 0:
+			break
+
+		try:
+			return loads(f"[{text[pos : end + 1]}]"), end + 1
+		except ValueError:
+			pass  # not the end of an item after all
+
+	return None, pos
+
+
+def find_item_end(text: str, start: int, end: int) -> int:
+	"""Return the position of the last "}" before `end` that looks like the end of an item."""
+	while True:
+		end = text.rfind("}", start, end)
+		if end < 0 or ITEM_END.match(text, end):
+			return end
+
+
+def skip_whitespace(text: str, pos: int) -> int:
+	while pos < len(text) and text[pos] in WHITESPACE:
+		pos += 1
+	return pos
@@ -0,0 +1,54 @@
+# Copyright (c) 2024, ALYF GmbH and Contributors
+# See license.txt
+import asyncio
+import io
+import threading
+import time
+import unittest
+
+import requests
+
+from banking.connectors.async_admin_request import AsyncAdminRequest
+
+
+def make_response(body: bytes) -> requests.Response:
+	response = requests.Response()
+	response.status_code = 200
+	response.headers["Content-Type"] = "application/json"
+	response.raw = io.BytesIO(body)
+	return response
+
+
+class FakeRequest:
+	def __init__(self) -> None:
+		self.in_flight = self.max_in_flight = 0
+		self.lock = threading.Lock()
+
+	def consent_accounts(self, consent_id: str, consent_token: str) -> requests.Response:
+		with self.lock:
+			self.in_flight += 1
+			self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+		time.sleep(0.05)
+		with self.lock:
+			self.in_flight -= 1
+
+		return make_response(b'{"message": {"consent_id": "%s"}}' % consent_id.encode())
+
+
+class TestAsyncAdminRequest(unittest.TestCase):
+	def test_concurrency_limit(self):
+		request = FakeRequest()
+
+		async def fetch_all():
+			async with AsyncAdminRequest(request, concurrency=3) as client:
+				return await asyncio.gather(
+					*(client.consent_accounts(str(index), "token") for index in range(9))
+				)
+
+		results = asyncio.run(fetch_all())
+
+		self.assertEqual(
+			[value["message"]["consent_id"] for _, value in results], [str(i) for i in range(9)]
+		)
+		self.assertEqual(request.max_in_flight, 3)
@@ -0,0 +1,35 @@
+# Copyright (c) 2024, ALYF GmbH and Contributors
+# See license.txt
+import unittest
+
+from banking.connectors.bloom_filter import BloomFilter
+
+
+class TestBloomFilter(unittest.TestCase):
+	def test_no_false_negatives(self):
+		bloom_filter = BloomFilter.for_capacity(1000)
+		items = [f"transaction-{i}" for i in range(1000)]
+		bits = bloom_filter.to_bytes(items)
+
+		self.assertTrue(all(bloom_filter.might_contain(bits, item) for item in items))
+		self.assertGreaterEqual(bloom_filter.capacity, 1000)
+
+	def test_error_rate(self):
+		bloom_filter = BloomFilter.for_capacity(1000)
+		bits = bloom_filter.to_bytes(f"transaction-{i}" for i in range(1000))
+
+		false_positives = sum(
+			bloom_filter.might_contain(bits, f"other-{i}") for i in range(10000)
+		)
+		self.assertLess(false_positives, 200)  # 1% expected
+
+	def test_redis_bit_order(self):
+		bloom_filter = BloomFilter(16)
+		bits = bloom_filter.to_bytes(["a"])
+		# Same bits as `SETBIT key <position> 1` for every position
+		expected = bytearray(2)
+		for position in bloom_filter.positions("a"):
+			expected[position // 8] |= 1 << (7 - position % 8)
+
+		self.assertEqual(bits, bytes(expected))
+		self.assertFalse(bloom_filter.might_contain(b"", "a"))
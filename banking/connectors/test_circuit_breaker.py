@@ -0,0 +1,93 @@
+# Copyright (c) 2024, ALYF GmbH and Contributors
+# See license.txt
+import io
+import unittest
+
+import requests
+
+from banking.connectors.circuit_breaker import (
+	CircuitBreaker,
+	CircuitOpenError,
+	get_local_state,
+)
+
+
+def make_response(status_code: int) -> requests.Response:
+	response = requests.Response()
+	response.status_code = status_code
+	response.raw = io.BytesIO(b"")
+	return response
+
+
+def fail():
+	raise requests.exceptions.ConnectionError
+
+
+class BrokenRedis:
+	def eval(self, *args):
+		raise ConnectionError("Redis is down")
+
+
+class TestCircuitBreaker(unittest.TestCase):
+	def get_breaker(self, name: str) -> CircuitBreaker:
+		return CircuitBreaker(name, redis=BrokenRedis(), failure_threshold=2, cooldown=60)
+
+	def open_circuit(self, breaker: CircuitBreaker) -> None:
+		for _ in range(2):
+			with self.assertRaises(requests.exceptions.ConnectionError):
+				breaker.call(fail)
+
+	def end_cooldown(self, breaker: CircuitBreaker) -> None:
+		get_local_state(breaker.key).opened_at -= 61
+
+	def test_opens_after_consecutive_failures(self):
+		breaker = self.get_breaker("test-open")
+		breaker.call(lambda: make_response(503))
+		breaker.call(lambda: make_response(200))  # resets the count
+		breaker.call(lambda: make_response(404))  # client errors don't count
+		breaker.call(lambda: make_response(503))
+		breaker.call(lambda: make_response(502))
+
+		sent = []
+		with self.assertRaises(CircuitOpenError) as context:
+			breaker.call(lambda: sent.append(1))
+
+		self.assertFalse(sent)
+		self.assertGreater(context.exception.retry_in, 59)
+
+	def test_single_probe_after_cooldown(self):
+		breaker = self.get_breaker("test-probe")
+		self.open_circuit(breaker)
+		self.end_cooldown(breaker)
+
+		def send():
+			# Other requests are rejected while the probe is in flight
+			with self.assertRaises(CircuitOpenError):
+				breaker.call(lambda: make_response(200))
+			return make_response(200)
+
+		self.assertEqual(breaker.call(send).status_code, 200)
+		self.assertEqual(breaker.call(lambda: make_response(200)).status_code, 200)
+
+	def test_failed_probe_reopens(self):
+		breaker = self.get_breaker("test-reopen")
+		self.open_circuit(breaker)
+		self.end_cooldown(breaker)
+
+		self.assertEqual(breaker.call(lambda: make_response(500)).status_code, 500)
+		with self.assertRaises(CircuitOpenError):
+			breaker.call(lambda: make_response(200))
+
+	def test_probe_with_other_error(self):
+		breaker = self.get_breaker("test-probe-error")
+		self.open_circuit(breaker)
+		self.end_cooldown(breaker)
+
+		def send():
+			raise requests.exceptions.ChunkedEncodingError
+
+		with self.assertRaises(requests.exceptions.ChunkedEncodingError):
+			breaker.call(send)
+
+		self.end_cooldown(breaker)
+		self.assertEqual(breaker.call(lambda: make_response(200)).status_code, 200)
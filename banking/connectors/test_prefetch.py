@@ -0,0 +1,114 @@
+# Copyright (c) 2024, ALYF GmbH and Contributors
+# See license.txt
+import threading
+import time
+import unittest
+
+from banking.connectors.prefetch import PagePipeline
+
+
+class FakePage:
+	def __init__(self, number: int, items: list, fail: bool = False):
+		self.number = number
+		self.items = items
+		self.fail = fail
+
+	def __iter__(self):
+		for item in self.items:
+			yield item
+		if self.fail:
+			raise ConnectionError("connection reset")
+
+
+class TestPagePipeline(unittest.TestCase):
+	def test_pages_in_order(self):
+		def fetch_next(page):
+			number = page.number + 1 if page else 0
+			return FakePage(number, [number] * 3) if number < 4 else None
+
+		pages = PagePipeline(fetch_next).start()
+		items = [item for page in pages for item in page]
+		self.assertEqual(pages.close(), [])
+		self.assertEqual(items, [0, 0, 0, 1, 1, 1, 2, 2, 2, 3, 3, 3])
+
+	def test_fetches_one_page_ahead(self):
+		fetched = []
+		page_taken = threading.Event()
+
+		def fetch_next(page):
+			number = page.number + 1 if page else 0
+			fetched.append(number)
+			if number == 1:
+				page_taken.set()
+			return FakePage(number, [number]) if number < 10 else None
+
+		pages = PagePipeline(fetch_next).start()
+		first = next(iter(pages))
+		self.assertTrue(page_taken.wait(5))
+		# Page 1 is fetched while page 0 is processed, page 2 waits for the consumer
+		self.assertEqual(fetched, [0, 1])
+		first.drain()
+
+		leftover = pages.close()
+		self.assertEqual([page.number for page in leftover], [1])
+		self.assertEqual(fetched, [0, 1])
+
+	def test_failed_page(self):
+		def fetch_next(page):
+			return None if page else FakePage(0, [1, 2], fail=True)
+
+		pages = PagePipeline(fetch_next).start()
+		page = next(iter(pages))
+		with self.assertRaises(ConnectionError):
+			list(page)
+		page.drain()
+		self.assertEqual(pages.close(), [])
+
+	def test_failed_request(self):
+		def fetch_next(page):
+			raise TimeoutError
+
+		pages = PagePipeline(fetch_next).start()
+		with self.assertRaises(TimeoutError):
+			list(pages)
+		self.assertEqual(pages.close(), [])
+
+	def test_download_waits_for_slow_consumer(self):
+		produced = []
+
+		class LargePage(FakePage):
+			def __iter__(self):
+				for item in self.items:
+					produced.append(item)
+					yield item
+
+		def fetch_next(page):
+			number = page.number + 1 if page else 0
+			return LargePage(number, range(1000)) if number < 3 else None
+
+		pages = PagePipeline(fetch_next, buffer_size=10).start()
+		page_iter = iter(pages)
+		first = next(page_iter)
+		time.sleep(0.2)  # the consumer is busy with something else
+
+		# Neither the current nor the next page were downloaded as a whole
+		self.assertLessEqual(len(produced), 11)
+
+		for consumed, _ in enumerate(first, 1):
+			time.sleep(0)
+			# At most one buffer each of this and the next page ahead of the consumer
+			self.assertLessEqual(len(produced) - consumed, 2 * (10 + 1))
+
+		self.assertEqual(sum(1 for page in page_iter for _ in page), 2000)
+		self.assertEqual(pages.close(), [])
+		self.assertEqual(len(produced), 3000)
+
+	def test_close_with_abandoned_page(self):
+		def fetch_next(page):
+			return None if page else FakePage(0, range(100))
+
+		pages = PagePipeline(fetch_next, buffer_size=5).start()
+		next(iter(pages))
+		# The download is blocked on the full buffer, closing must not hang
+		self.assertEqual(pages.close(), [])
+		self.assertFalse(pages.thread.is_alive())
@@ -0,0 +1,56 @@
+# Copyright (c) 2024, ALYF GmbH and Contributors
+# See license.txt
+import unittest
+
+from banking.connectors.rate_limiter import RateLimiter, TokenBucket
+
+
+class FakeClock:
+	def __init__(self):
+		self.now = 100.0
+
+	def __call__(self):
+		return self.now
+
+
+class BrokenRedis:
+	def eval(self, *args):
+		raise ConnectionError("Redis is down")
+
+
+class TestTokenBucket(unittest.TestCase):
+	def test_burst_then_spaced(self):
+		clock = FakeClock()
+		bucket = TokenBucket(rate=2, capacity=2, clock=clock)
+
+		self.assertEqual([bucket.reserve() for _ in range(2)], [0, 0])
+		# Callers beyond the burst reserve the following slots
+		self.assertEqual([bucket.reserve() for _ in range(3)], [0.5, 1.0, 1.5])
+
+	def test_refill(self):
+		clock = FakeClock()
+		bucket = TokenBucket(rate=2, capacity=2, clock=clock)
+		for _ in range(2):
+			bucket.reserve()
+
+		clock.now += 0.5
+		self.assertEqual(bucket.reserve(), 0)
+		self.assertEqual(bucket.reserve(), 0.5)
+
+		# Never more than the burst capacity
+		clock.now += 60
+		self.assertEqual([bucket.reserve() for _ in range(3)], [0, 0, 0.5])
+
+
+class TestRateLimiter(unittest.TestCase):
+	def test_fallback_without_redis(self):
+		slept = []
+		limiter = RateLimiter(
+			rate=1, key="test-fallback", redis=BrokenRedis(), sleep=slept.append
+		)
+		for _ in range(3):
+			limiter.acquire()
+
+		self.assertEqual(len(slept), 2)
+		self.assertAlmostEqual(slept[0], 1, places=2)
+		self.assertAlmostEqual(slept[1], 2, places=2)
@@ -0,0 +1,120 @@
+# Copyright (c) 2024, ALYF GmbH and Contributors
+# See license.txt
+import io
+import unittest
+
+import requests
+
+from banking.connectors.retry import RetryBudget, RetryPolicy
+
+
+def make_response(status_code: int, headers: dict = None) -> requests.Response:
+	response = requests.Response()
+	response.status_code = status_code
+	response.headers.update(headers or {})
+	response.raw = io.BytesIO(b"")
+	return response
+
+
+class TestRetryPolicy(unittest.TestCase):
+	def setUp(self):
+		self.delays = []
+
+	def get_policy(self, **kwargs) -> RetryPolicy:
+		return RetryPolicy(sleep=self.delays.append, **kwargs)
+
+	def send_sequence(self, *results):
+		results = list(results)
+
+		def send():
+			result = results.pop(0)
+			if isinstance(result, Exception):
+				raise result
+			return result
+
+		return send
+
+	def test_retry_gateway_error(self):
+		send = self.send_sequence(make_response(502), make_response(503), make_response(200))
+		response = self.get_policy(max_retries=3).call(send)
+
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(len(self.delays), 2)
+
+	def test_honour_retry_after(self):
+		send = self.send_sequence(make_response(429, {"Retry-After": "7"}), make_response(200))
+		self.get_policy().call(send)
+
+		self.assertEqual(self.delays, [7.0])
+
+	def test_retry_after_too_long(self):
+		send = self.send_sequence(make_response(429, {"Retry-After": "3600"}))
+		response = self.get_policy(max_retry_after=60).call(send)
+
+		self.assertEqual(response.status_code, 429)
+		self.assertEqual(self.delays, [])
+
+	def test_non_idempotent_call(self):
+		send = self.send_sequence(make_response(502))
+		response = self.get_policy().call(send, idempotent=False)
+		self.assertEqual(response.status_code, 502)
+
+		send = self.send_sequence(requests.exceptions.ConnectTimeout(), make_response(200))
+		response = self.get_policy().call(send, idempotent=False)
+		self.assertEqual(response.status_code, 200)
+
+		send = self.send_sequence(requests.exceptions.ReadTimeout())
+		with self.assertRaises(requests.exceptions.ReadTimeout):
+			self.get_policy().call(send, idempotent=False)
+
+	def test_consent_calls_not_resent_after_processing(self):
+		"""Consent calls rotate the token, only resend them if they were never processed"""
+		from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+		from banking.connectors.admin_request import IDEMPOTENT_METHODS
+
+		self.assertNotIn("banking_admin.api.fetch_consent_transactions", IDEMPOTENT_METHODS)
+		self.assertNotIn("banking_admin.api.fetch_consent_accounts", IDEMPOTENT_METHODS)
+
+		for result in (
+			make_response(502),
+			make_response(504),
+			make_response(503),
+			requests.exceptions.ReadTimeout(),
+			requests.exceptions.ConnectionError("Connection reset by peer"),
+		):
+			send = self.send_sequence(result, make_response(200))
+			try:
+				response = self.get_policy().call(send, idempotent=False)
+			except requests.exceptions.RequestException:
+				continue
+			self.assertNotEqual(response.status_code, 200)
+
+		self.assertEqual(self.delays, [])
+
+		refused = requests.exceptions.ConnectionError(
+			MaxRetryError(None, "/", NewConnectionError(None, "Connection refused"))
+		)
+		for result in (
+			refused,
+			make_response(429),
+			make_response(503, {"Retry-After": "1"}),
+		):
+			send = self.send_sequence(result, make_response(200))
+			response = self.get_policy().call(send, idempotent=False)
+			self.assertEqual(response.status_code, 200)
+
+	def test_budget_shared_across_calls(self):
+		policy = self.get_policy(max_retries=5, budget=RetryBudget(2))
+
+		send = self.send_sequence(make_response(503), make_response(200))
+		self.assertEqual(policy.call(send).status_code, 200)
+
+		send = self.send_sequence(make_response(503), make_response(503))
+		self.assertEqual(policy.call(send).status_code, 503)
+		self.assertEqual(len(self.delays), 2)
+
+	def test_backoff_is_capped(self):
+		policy = self.get_policy(backoff_factor=1, max_backoff=4)
+		for attempt in range(10):
+			self.assertLessEqual(policy.get_backoff(attempt), 4)
@@ -0,0 +1,78 @@
+# Copyright (c) 2024, ALYF GmbH and Contributors
+# See license.txt
+import json
+import os
+import unittest
+from unittest.mock import patch
+
+from banking.connectors.stream_decoder import StreamDecoder
+
+FIXTURE = os.path.join(
+	os.path.dirname(__file__),
+	"..",
+	"demo_responses",
+	"transactions",
+	"trans-psd2-de-embedded-consent.json",
+)
+
+
+def decode_in_chunks(text: str, chunk_size: int):
+	decoder = StreamDecoder()
+	items = []
+	for start in range(0, len(text), chunk_size):
+		items.extend(decoder.feed(text[start : start + chunk_size]))
+	return items, decoder.close()
+
+
+class TestStreamDecoder(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		with open(FIXTURE) as f:
+			cls.transactions = json.load(f)["data"]["result"]["transactions"]
+
+	def test_items_and_envelope(self):
+		response = {
+			"message": {
+				"result": {
+					"pagination": {"url": 'https://x/"transactions":[', "next": {"offset": "2"}},
+					"transactions": self.transactions,
+				},
+				"consent_token": "abc",
+			}
+		}
+		text = json.dumps(response, indent=1, ensure_ascii=False)
+
+		for chunk_size in (1, 7, 64, len(text)):
+			items, envelope = decode_in_chunks(text, chunk_size)
+			self.assertEqual(items, self.transactions)
+			self.assertEqual(envelope["message"]["result"]["transactions"], [])
+			self.assertEqual(envelope["message"]["result"]["pagination"]["next"]["offset"], "2")
+			self.assertEqual(envelope["message"]["consent_token"], "abc")
+
+	def test_item_end_within_string(self):
+		transactions = [
+			{"reference": 'a"},{"b', "amount": 1},
+			{"reference": "}]", "nested": [{"x": "},{"}]},
+			{"reference": "}  ,  {", "amount": 3},
+		] * 3
+		text = json.dumps({"message": {"result": {"transactions": transactions}}})
+
+		for chunk_size in (1, 5, 33, len(text)):
+			items, _ = decode_in_chunks(text, chunk_size)
+			self.assertEqual(items, transactions)
+
+			with patch("banking.connectors.stream_decoder.loads", json.loads):
+				items, _ = decode_in_chunks(text, chunk_size)
+			self.assertEqual(items, transactions)
+
+	def test_document_without_streamed_array(self):
+		response = {"message": {"error": {"transactions": [1, 2]}, "state": "EXCEPTION"}}
+		items, envelope = decode_in_chunks(json.dumps(response), 5)
+
+		self.assertEqual(items, [])
+		self.assertEqual(envelope, response)
+
+	def test_incomplete_document(self):
+		decoder = StreamDecoder()
+		list(decoder.feed('{"message": {"result": {"transactions": [{"a": 1}, {"b"'))
+		self.assertRaises(ValueError, decoder.close)
@@ -0,0 +1,72 @@
+# Copyright (c) 2024, ALYF GmbH and Contributors
+# See license.txt
+import json
+import os
+import unittest
+
+from banking.connectors.transaction_normalizer import (
+	TransactionStatus,
+	Watermark,
+	normalize_transaction,
+	normalize_transactions,
+)
+
+FIXTURE = os.path.join(
+	os.path.dirname(__file__),
+	"..",
+	"demo_responses",
+	"transactions",
+	"trans-psd2-de-embedded-consent.json",
+)
+
+
+class TestTransactionNormalizer(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		with open(FIXTURE) as f:
+			cls.transactions = json.load(f)["data"]["result"]["transactions"]
+
+	def test_debit(self):
+		row = normalize_transaction(self.transactions[0])
+
+		self.assertEqual(row.transaction_id, "50d18876ee83099984eb0e1ef1c93e3f")
+		self.assertEqual(row.date, "2022-12-03")  # value date
+		self.assertEqual(row.status, TransactionStatus.SETTLED)
+		self.assertEqual(row.amount, -324229)
+		self.assertEqual((row.deposit, row.withdrawal), (0, 3242.29))
+		self.assertEqual(row.currency, "EUR")
+		self.assertEqual(row.party_name, "Hans Mustermann")
+		self.assertEqual(row.party_iban, "DE18000000006636981175")
+		self.assertEqual(row.party_account_number, "000000006636981175")
+
+	def test_credit(self):
+		transaction = dict(self.transactions[0], type="CREDIT", value_date=None)
+		row = normalize_transaction(transaction)
+
+		self.assertEqual(row.date, "2022-12-02")
+		self.assertEqual((row.deposit, row.withdrawal), (3242.29, 0))
+
+	def test_pending_without_id_is_skipped(self):
+		pending = dict(self.transactions[0], state="PENDING", transaction_id=None)
+		rows = list(normalize_transactions([pending, self.transactions[1]]))
+
+		self.assertEqual(len(rows), 1)
+		self.assertEqual(rows[0].transaction_id, self.transactions[1]["transaction_id"])
+
+	def test_watermark(self):
+		rows = list(normalize_transactions(self.transactions))
+		watermark = Watermark()
+		watermark.advance(rows)
+
+		latest = max(row.booking_date for row in rows)
+		self.assertEqual(watermark.date, latest)
+		self.assertEqual(
+			watermark.transaction_ids,
+			{row.transaction_id for row in rows if row.booking_date == latest},
+		)
+		self.assertTrue(all(watermark.is_known(row) for row in rows if row.booking_date == latest))
+		self.assertFalse(any(watermark.is_known(row) for row in rows if row.booking_date != latest))
+
+		# Older rows don't move it back
+		watermark.advance([rows[-1]._replace(booking_date="2000-01-01", transaction_id="x")])
+		self.assertEqual(watermark.date, latest)
@@ -0,0 +1,114 @@
+# Copyright (c) 2024, ALYF GmbH and contributors
+# For license information, please see license.txt
+from enum import Enum
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Set
+
+
+class TransactionStatus(str, Enum):
+	"""Bank Transaction status of a Kosma transaction state."""
+
+	SETTLED = "Settled"
+	PENDING = "Pending"
+
+
+# TODO: is "Settled" ok for CANCELED/FAILED? Should we even consider making cancelled/failed records
+STATE_MAP = {
+	"PROCESSED": TransactionStatus.SETTLED,
+	"PENDING": TransactionStatus.PENDING,
+	"CANCELED": TransactionStatus.SETTLED,
+	"FAILED": TransactionStatus.SETTLED,
+}
+
+
+class TransactionRow(NamedTuple):
+	"""A Kosma transaction, flattened to what is stored in a Bank Transaction."""
+
+	transaction_id: Optional[str]
+	date: str  # value date, else booking date (ISO)
+	status: TransactionStatus
+	amount: int  # in minor units, positive for credits, negative for debits
+	currency: Optional[str]
+	reference_number: Optional[str]
+	description: Optional[str]
+	party_name: Optional[str]
+	party_iban: Optional[str]
+	party_account_number: Optional[str]
+	booking_date: Optional[str]
+
+	@property
+	def deposit(self) -> float:
+		return self.amount / 100 if self.amount > 0 else 0
+
+	@property
+	def withdrawal(self) -> float:
+		return -self.amount / 100 if self.amount < 0 else 0
+
+
+def normalize_transaction(transaction: Dict) -> Optional[TransactionRow]:
+	"""
+	Return the row of a Kosma transaction or `None` if it must not be inserted.
+
+	Ref: https://docs.openbanking.klarna.com/xs2a/objects/transaction.html
+	"""
+	transaction_id = transaction.get("transaction_id")
+	state = transaction.get("state")
+	if not transaction_id and state == "PENDING":
+		# Dont insert pending transactions. transaction_id is absent only for Pending state
+		return None
+
+	# https://docs.openbanking.klarna.com/xs2a/objects/amount.html
+	amount_data = transaction.get("amount") or {}
+	amount = amount_data.get("amount", 0)
+	counter_party = transaction.get("counter_party") or {}
+
+	return TransactionRow(
+		transaction_id,
+		transaction.get("value_date") or transaction.get("date"),
+		STATE_MAP[state],
+		amount if transaction.get("type") == "CREDIT" else -amount,
+		amount_data.get("currency"),
+		(transaction.get("bank_references") or {}).get("end_to_end"),
+		transaction.get("reference"),
+		counter_party.get("holder_name"),
+		counter_party.get("iban"),
+		counter_party.get("account_number"),
+		transaction.get("booking_date") or transaction.get("date"),
+	)
+
+
+def normalize_transactions(transactions: Iterable[Dict]) -> Iterator[TransactionRow]:
+	"""Normalize a page (or stream) of Kosma transactions, leaving out the ones to skip."""
+	for transaction in transactions:
+		row = normalize_transaction(transaction)
+		if row:
+			yield row
+
+
+class Watermark:
+	"""
+	How far the transactions of an account have been synced: the latest booking date
+	and the IDs of the transactions booked on that date.
+
+	The next sync only needs to start at that date and can drop the listed IDs
+	without looking them up.
+	"""
+
+	def __init__(self, date: Optional[str] = None, transaction_ids: Iterable[str] = ()) -> None:
+		self.date = date
+		self.transaction_ids: Set[str] = set(transaction_ids)
+
+	def is_known(self, row: TransactionRow) -> bool:
+		return bool(row.transaction_id) and row.booking_date == self.date and (
+			row.transaction_id in self.transaction_ids
+		)
+
+	def advance(self, rows: List[TransactionRow]) -> None:
+		"""Move the watermark past `rows`, which are stored now."""
+		for row in rows:
+			if not (row.transaction_id and row.booking_date):
+				continue
+
+			if not self.date or row.booking_date > self.date:
+				self.date, self.transaction_ids = row.booking_date, {row.transaction_id}
+			elif row.booking_date == self.date:
+				self.transaction_ids.add(row.transaction_id)
@@ -111,6 +111,12 @@ override_doctype_class = {
 # 	}
 # }
 
+doc_events = {
+	"Bank Account": {
+		"on_trash": "banking.klarna_kosma_integration.doctype.bank_account_sync_state.bank_account_sync_state.delete_sync_state"
+	}
+}
+
 # Scheduled Tasks
 # ---------------
 
@@ -118,6 +124,9 @@ scheduler_events = {
 	"daily": [
 		"banking.klarna_kosma_integration.doctype.banking_settings.banking_settings.sync_all_accounts_and_transactions"
 	],
+	"cron": {
+		"*/5 * * * *": ["banking.klarna_kosma_integration.scheduled_sync.retry_deferred_syncs"],
+	},
 }
 
 # Testing
@@ -1,12 +1,34 @@
 # Copyright (c) 2023, ALYF GmbH and contributors
 # For license information, please see license.txt
-from typing import Dict, Optional
+import asyncio
+from contextlib import contextmanager, suppress
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 
 import frappe
+import requests
+from redis.exceptions import LockError
 
 from banking.connectors.admin_request import AdminRequest
-from banking.connectors.admin_transaction import AdminTransaction
-from banking.klarna_kosma_integration.exception_handler import ExceptionHandler
+from banking.connectors.admin_transaction import (
+	AdminTransaction,
+	AdminTransactionStream,
+)
+from banking.connectors.async_admin_request import AsyncAdminRequest
+from banking.connectors.circuit_breaker import CircuitBreaker
+from banking.connectors.prefetch import PagePipeline, PrefetchedPage
+from banking.connectors.rate_limiter import RateLimiter
+from banking.connectors.retry import RetryBudget, RetryPolicy
+from banking.connectors.transaction_normalizer import Watermark
+from banking.klarna_kosma_integration.admin_config import get_admin_config
+from banking.klarna_kosma_integration.doctype.bank_account_sync_state.bank_account_sync_state import (
+	BankAccountSyncState,
+	get_sync_state,
+)
+from banking.klarna_kosma_integration.exception_handler import (
+	AdminUnavailableError,
+	BankingError,
+	ExceptionHandler,
+)
 from banking.klarna_kosma_integration.utils import (
 	account_last_sync_date,
 	add_bank,
@@ -24,6 +46,12 @@ from banking.klarna_kosma_integration.utils import (
 	to_json,
 )
 
+DEFERRED_SYNCS_KEY = "banking_deferred_syncs"
+# Client errors that say nothing about the requested page
+RESUMABLE_STATUS_CODES = frozenset({401, 403, 408, 429})
+SYNC_LOCK_TIMEOUT = 60 * 60  # seconds, released by then even if the job was killed
+FLOW_SYNC_LOCK_WAIT = 60  # seconds, well within the job timeout of the default queue
+
 
 class Admin:
 	"""A class that directly communicates with the Banking Admin App."""
@@ -32,22 +60,54 @@ class Admin:
 		self.ip_address = get_current_ip()
 		self.user_agent = frappe.get_request_header("User-Agent") if frappe.request else None
 
-		settings = frappe.get_single("Banking Settings")
-		self.use_test_environment = settings.use_test_environment
-		self.api_token = settings.get_password("api_token")
-		self.customer_id = settings.customer_id
-		self.url = settings.admin_endpoint + "/api/method/"
+		config = get_admin_config()
+		self.use_test_environment = config.use_test_environment
+		self.api_token = config.api_token
+		self.customer_id = config.customer_id
+		self.url = config.url
+		self.pool_size = config.pool_size
+		self.timeout = config.timeout
+		# One budget per Admin object, i.e. shared by all pages of a sync
+		self.retry_policy = RetryPolicy(
+			max_retries=config.max_retries,
+			budget=RetryBudget(config.retry_budget),
+		)
+		self.sync_concurrency = config.sync_concurrency
+		self.rate_limiter = (
+			RateLimiter(config.requests_per_second, self.customer_id, redis=frappe.cache())
+			if config.requests_per_second
+			else None
+		)
+		self.circuit_breaker = (
+			CircuitBreaker(
+				self.url,
+				redis=frappe.cache(),
+				failure_threshold=config.circuit_failure_threshold,
+				cooldown=config.circuit_cooldown,
+			)
+			if config.circuit_failure_threshold
+			else None
+		)
+		self._request = None
 
 	@property
-	def request(self):
-		return AdminRequest(
-			ip_address=self.ip_address,
-			user_agent=self.user_agent,
-			api_token=self.api_token,
-			url=self.url,
-			customer_id=self.customer_id,
-			use_test_environment=self.use_test_environment,
-		)
+	def request(self) -> AdminRequest:
+		if not self._request:
+			self._request = AdminRequest(
+				ip_address=self.ip_address,
+				user_agent=self.user_agent,
+				api_token=self.api_token,
+				url=self.url,
+				customer_id=self.customer_id,
+				use_test_environment=self.use_test_environment,
+				pool_size=self.pool_size,
+				timeout=self.timeout,
+				retry_policy=self.retry_policy,
+				rate_limiter=self.rate_limiter,
+				circuit_breaker=self.circuit_breaker,
+			)
+
+		return self._request
 
 	def get_client_token(
 		self,
@@ -71,7 +131,7 @@ class Admin:
 			)
 
 			session_flow_response.raise_for_status()
-			session_flow_response = session_flow_response.json().get("message", {})
+			session_flow_response = to_json(session_flow_response).get("message", {})
 
 			session_details = session_flow_response.get("session_data", {})
 			flow_details = session_flow_response.get("flow_data", {})
@@ -91,7 +151,7 @@ class Admin:
 			response = self.request.flow_accounts(session_id, flow_id)
 
 			response.raise_for_status()
-			accounts_response = response.json().get("message", {})
+			accounts_response = to_json(response).get("message", {})
 			accounts_result = accounts_response.get("result", {})
 
 			bank_name = add_bank(accounts_result.get("bank_data", {}))
@@ -110,22 +170,31 @@ class Admin:
 			set_session_state(session_id_short, accounts_response)
 
 	def flow_transactions(self, account: str, session_id_short: str):
-		next_page, url, offset, transactions_value = True, None, None, None
+		transactions_value = None
 		try:
 			session_id, flow_id = get_session_flow_ids(session_id_short)
-			while next_page:
-				response = self.request.flow_transactions(session_id, flow_id, url, offset)
-				response.raise_for_status()
-				transactions_value = response.json().get("message", {})
 
-				# Process Request Response
-				transaction = AdminTransaction(transactions_value)
-				next_page = transaction.is_next_page()
-				if next_page:
-					url, offset = transaction.next_page_request()
+			def fetch_next(page):
+				url, offset = None, None
+				if page:
+					if not (page.response.ok and page.is_next_page()):
+						return None
+					url, offset = page.next_page_request()
 
-				if transaction.transaction_list:
-					create_bank_transactions(account, transaction.transaction_list, via_flow_api=True)
+				response = self.request.flow_transactions(
+					session_id, flow_id, url, offset, stream=True
+				)
+				return AdminTransactionStream(response)
+
+			pages = PagePipeline(fetch_next).start()
+			try:
+				for page in pages:
+					try:
+						self.insert_transaction_page(account, page, via_flow_api=True)
+					finally:
+						transactions_value = page.value
+			finally:
+				pages.close()
 		except Exception as exc:
 			ExceptionHandler(exc)
 		finally:
@@ -145,34 +214,116 @@ class Admin:
 		except Exception as exc:
 			ExceptionHandler(exc)
 
+	def consent_accounts_concurrently(
+		self, consents: List[Tuple[str, str]]
+	) -> Dict[Tuple[str, str], List[Dict]]:
+		"""
+		Fetch the accounts of many consents (bank, company) at once. Consents that fail
+		get no accounts.
+
+		Every consent gets a single request, so rotating its token doesn't conflict. Tokens
+		are stored on the event loop's thread, i.e. one at a time.
+		"""
+
+		async def fetch(client: AsyncAdminRequest, bank: str, company: str) -> List[Dict]:
+			try:
+				consent_id, consent_token = get_consent_data(bank, company)
+				response, response_value = await client.consent_accounts(consent_id, consent_token)
+				accounts_response_value = response_value.get("message", {})
+
+				exchange_consent_token(accounts_response_value, bank, company)
+				response.raise_for_status()
+
+				return accounts_response_value.get("result", {}).get("accounts", [])
+			except Exception as exc:
+				with suppress(BankingError):
+					ExceptionHandler(exc)
+				return []
+
+		async def fetch_all() -> List[List[Dict]]:
+			async with AsyncAdminRequest(self.request, self.sync_concurrency) as client:
+				return await asyncio.gather(
+					*(fetch(client, bank, company) for bank, company in consents)
+				)
+
+		return dict(zip(consents, asyncio.run(fetch_all())))
+
 	def consent_transactions(self, account: str, start_date: str):
-		next_page, url, offset = True, None, None
+		state, resumed, pages_done = None, False, 0
 		try:
 			account_id, bank, company = frappe.db.get_value(
 				"Bank Account", account, ["kosma_account_id", "bank", "company"]
 			)
 			consent_id, consent_token = get_consent_data(bank, company)
-			while next_page:
+			state = get_sync_state(account)
+			start_date, resume_url, resume_offset = state.get_resume_point(start_date)
+			watermark = state.get_watermark()
+			resumed = bool(resume_offset)
+			frappe.db.commit()
+
+			# Consent pages are not prefetched: every response rotates the consent token, so
+			# the next page is only requested once the token of this one is stored
+			url, offset = resume_url, resume_offset
+			while True:
 				response = self.request.consent_transactions(
-					account_id, start_date, consent_id, consent_token, url, offset
+					account_id, start_date, consent_id, consent_token, url, offset, stream=True
 				)
-				transactions_value = to_json(response).get("message", {})
+				page = AdminTransactionStream(response)
+				# Store the rotated token as soon as the page has arrived, before inserting
+				# anything can fail or the job can be killed
+				page.read()
+				consent_token = exchange_consent_token(page.value, bank, company) or consent_token
 
-				new_consent_token = exchange_consent_token(transactions_value, bank, company)
-				response.raise_for_status()
+				self.insert_transaction_page(account, page, watermark=watermark)
+				self.save_checkpoint(state, page, watermark)
 
-				# Process Request Response
-				transaction = AdminTransaction(transactions_value)
-				next_page = transaction.is_next_page()
-				if next_page:
-					url, offset = transaction.next_page_request()
-					consent_token = new_consent_token
+				# Keep the progress of finished pages if a later page fails
+				frappe.db.commit()
+				pages_done += 1
 
-				if transaction.transaction_list:
-					create_bank_transactions(account, transaction.transaction_list)
+				if not page.is_next_page():
+					break
+
+				url, offset = page.next_page_request()
 		except Exception as exc:
+			if resumed and not pages_done and is_page_rejected(exc):
+				# The remembered page has expired, start over next time
+				state.reset()
+				frappe.db.commit()
+
 			ExceptionHandler(exc)
 
+	@staticmethod
+	def save_checkpoint(
+		state: BankAccountSyncState, page: AdminTransaction, watermark: Optional[Watermark]
+	) -> None:
+		"""Remember the next page of an inserted page, so that a crashed sync can resume."""
+		if page.is_next_page():
+			state.checkpoint(*page.next_page_request(), watermark)
+		else:
+			state.complete(watermark)
+
+	def insert_transaction_page(
+		self,
+		account: str,
+		page: Union[AdminTransactionStream, PrefetchedPage],
+		via_flow_api: bool = False,
+		watermark: Optional[Watermark] = None,
+	) -> Optional[str]:
+		"""
+		Insert the transactions of a page while it is being downloaded.
+		Return the latest date of the inserted transactions.
+		"""
+		try:
+			last_date = create_bank_transactions(
+				account, page, via_flow_api=via_flow_api, watermark=watermark
+			)
+		finally:
+			page.drain()
+
+		page.response.raise_for_status()
+		return last_date
+
 	def end_session(self, session_id: str, session_id_short: str) -> None:
 		self.request.end_session(session_id)
 		frappe.db.set_value("Klarna Kosma Session", session_id_short, "status", "Closed")
@@ -182,7 +333,7 @@ class Admin:
 		try:
 			subscription = self.request.fetch_subscription()
 			subscription.raise_for_status()
-			return subscription.json().get("message", {})
+			return to_json(subscription).get("message", {})
 		except Exception as exc:
 			ExceptionHandler(exc)
 
@@ -190,7 +341,7 @@ class Admin:
 		try:
 			url = self.request.get_customer_portal()
 			url.raise_for_status()
-			return url.json().get("message")
+			return to_json(url).get("message")
 		except Exception as exc:
 			ExceptionHandler(exc)
 
@@ -217,11 +368,96 @@ class Admin:
 		bank_consent.save()
 
 
+def is_page_rejected(exc: Exception) -> bool:
+	"""
+	Whether the Admin app rejected the requested page itself, e.g. an expired offset.
+	Outages, rate limits, network and authentication errors keep the page resumable.
+	"""
+	if not isinstance(exc, requests.exceptions.HTTPError) or exc.response is None:
+		return False
+
+	status_code = exc.response.status_code
+	return 400 <= status_code < 500 and status_code not in RESUMABLE_STATUS_CODES
+
+
 @frappe.whitelist()
 def sync_kosma_transactions(account: str, session_id_short: Optional[str] = None):
-	"""Fetch and insert paginated Kosma transactions"""
+	"""
+	Fetch and insert paginated Kosma transactions.
+
+	A consent sync is dropped if the account is being synced already. A flow sync is not
+	duplicate work (the user picked its period): it waits for the other sync and queues
+	up again if that takes too long.
+	"""
+	frappe.cache().delete(get_queued_sync_key(account, session_id_short))
+
+	wait = FLOW_SYNC_LOCK_WAIT if session_id_short else 0
+	with sync_lock(account, wait) as acquired:
+		if not acquired:
+			if session_id_short:
+				enqueue_sync(account, session_id_short)
+			return  # else already being synced by another job
+
+		if session_id_short:
+			Admin().flow_transactions(account, session_id_short)
+		else:
+			start_date = account_last_sync_date(account)
+			try:
+				Admin().consent_transactions(account, start_date)
+			except AdminUnavailableError:
+				defer_sync(account)
+
+
+def enqueue_sync(account: str, session_id_short: Optional[str] = None) -> bool:
+	"""
+	Enqueue the transactions sync of `account` (via the Flow API session, if given),
+	unless the same sync is queued already. Return whether it was enqueued.
+	"""
+	if not frappe.cache().set(
+		get_queued_sync_key(account, session_id_short), 1, ex=SYNC_LOCK_TIMEOUT, nx=True
+	):
+		return False
+
+	frappe.enqueue(
+		"banking.klarna_kosma_integration.admin.sync_kosma_transactions",
+		job_name=get_sync_job_name(account, session_id_short),
+		account=account,
+		session_id_short=session_id_short,
+		now=frappe.conf.developer_mode,
+	)
+	return True
+
+
+def get_sync_job_name(account: str, session_id_short: Optional[str] = None) -> str:
 	if session_id_short:
-		Admin().flow_transactions(account, session_id_short)
-	else:
-		start_date = account_last_sync_date(account)
-		Admin().consent_transactions(account, start_date)
+		return f"banking_sync|{account}|{session_id_short}"
+
+	return f"banking_sync|{account}"
+
+
+def get_queued_sync_key(account: str, session_id_short: Optional[str] = None) -> str:
+	key = f"banking_sync_queued|{account}"
+	return frappe.cache().make_key(f"{key}|{session_id_short}" if session_id_short else key)
+
+
+@contextmanager
+def sync_lock(account: str, wait: float = 0) -> Iterator[bool]:
+	"""
+	Hold the sync lock of `account` for the duration of the block, waiting at most `wait`
+	seconds for it. Yield whether it was acquired, if not another job is syncing the account.
+	"""
+	lock = frappe.cache().lock(
+		frappe.cache().make_key(f"banking_sync_lock|{account}"), timeout=SYNC_LOCK_TIMEOUT
+	)
+	acquired = lock.acquire(blocking=bool(wait), blocking_timeout=wait or None)
+	try:
+		yield acquired
+	finally:
+		if acquired:
+			with suppress(LockError):
+				lock.release()  # expired meanwhile
+
+
+def defer_sync(*accounts: str) -> None:
+	"""Remember accounts whose sync failed because the Admin app is down."""
+	frappe.cache().sadd(DEFERRED_SYNCS_KEY, *accounts)
@@ -0,0 +1,77 @@
+# Copyright (c) 2024, ALYF GmbH and contributors
+# For license information, please see license.txt
+from typing import Dict
+
+import frappe
+from frappe.utils import cint, flt
+
+from banking.connectors.admin_request import DEFAULT_POOL_SIZE, DEFAULT_TIMEOUT
+from banking.connectors.async_admin_request import DEFAULT_CONCURRENCY
+from banking.connectors.circuit_breaker import DEFAULT_COOLDOWN
+
+CONFIG_VERSION_KEY = "banking_admin_config_version"
+DEFAULT_SYNC_QUEUE = "long"
+
+# Config per site, kept for the lifetime of the worker process
+_configs: Dict[str, frappe._dict] = {}
+
+
+def get_admin_config() -> frappe._dict:
+	"""
+	Return the Banking Settings needed to talk to the Admin app.
+
+	The config is built once per site and worker process and rebuilt after the settings
+	were saved (by any worker). Within a request or job it is reused without even
+	checking the cached version.
+	"""
+	config = getattr(frappe.local, "banking_admin_config", None)
+	if config:
+		return config
+
+	version = frappe.cache().get_value(CONFIG_VERSION_KEY)
+	config = _configs.get(frappe.local.site)
+	if not (config and version and config.version == version):
+		if not version:
+			version = bump_config_version()
+
+		config = build_admin_config(version)
+		_configs[frappe.local.site] = config
+
+	frappe.local.banking_admin_config = config
+	return config
+
+
+def build_admin_config(version: str) -> frappe._dict:
+	settings = frappe.get_single("Banking Settings")
+	return frappe._dict(
+		version=version,
+		use_test_environment=settings.use_test_environment,
+		api_token=settings.get_password("api_token"),
+		customer_id=settings.customer_id,
+		url=settings.admin_endpoint + "/api/method/",
+		pool_size=cint(settings.connection_pool_size) or DEFAULT_POOL_SIZE,
+		timeout=(
+			flt(settings.connect_timeout) or DEFAULT_TIMEOUT[0],
+			flt(settings.read_timeout) or DEFAULT_TIMEOUT[1],
+		),
+		max_retries=cint(settings.max_retries),
+		retry_budget=cint(settings.retry_budget),
+		sync_concurrency=cint(settings.sync_concurrency) or DEFAULT_CONCURRENCY,
+		sync_queue=settings.sync_queue or DEFAULT_SYNC_QUEUE,
+		public_ip_address=settings.public_ip_address,
+		requests_per_second=flt(settings.requests_per_second),
+		circuit_failure_threshold=cint(settings.circuit_failure_threshold),
+		circuit_cooldown=cint(settings.circuit_cooldown) or DEFAULT_COOLDOWN,
+	)
+
+
+def clear_admin_config() -> None:
+	"""Make all workers rebuild the config on next use. Called when Banking Settings are saved."""
+	bump_config_version()
+	frappe.local.banking_admin_config = None
+
+
+def bump_config_version() -> str:
+	version = frappe.generate_hash(length=10)
+	frappe.cache().set_value(CONFIG_VERSION_KEY, version)
+	return version
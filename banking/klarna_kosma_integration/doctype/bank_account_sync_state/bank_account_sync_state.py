@@ -0,0 +1,102 @@
+# Copyright (c) 2024, ALYF GmbH and contributors
+# For license information, please see license.txt
+import json
+from typing import Optional, Tuple
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import formatdate
+
+from banking.connectors.transaction_normalizer import Watermark
+
+
+class BankAccountSyncState(Document):
+	"""Progress of the paginated transaction sync of a Bank Account, to resume after a crash."""
+
+	def get_resume_point(self, start_date: str) -> Tuple[str, Optional[str], Optional[str]]:
+		"""
+		Return the start date, url and offset to sync from.
+
+		An unfinished sync continues with its next page, otherwise a new one starts at
+		`start_date`.
+		"""
+		if self.status == "In Progress" and self.offset and self.start_date:
+			return formatdate(self.start_date, "YYYY-MM-dd"), self.url, self.offset
+
+		self.db_set(
+			{
+				"status": "In Progress",
+				"start_date": start_date,
+				"page": 0,
+				"url": None,
+				"offset": None,
+				"pending_watermark": None,
+				"pending_watermark_ids": None,
+			}
+		)
+		return start_date, None, None
+
+	def get_watermark(self) -> Watermark:
+		"""
+		Return how far the transactions have been synced, to skip the known ones. A resumed
+		sync continues with its pending watermark.
+		"""
+		if self.pending_watermark:
+			date, transaction_ids = self.pending_watermark, self.pending_watermark_ids
+		else:
+			date, transaction_ids = self.watermark, self.watermark_ids
+
+		return Watermark(
+			formatdate(date, "YYYY-MM-dd") if date else None, json.loads(transaction_ids or "[]")
+		)
+
+	def checkpoint(
+		self, url: Optional[str], offset: Optional[str], watermark: Optional[Watermark] = None
+	) -> None:
+		"""
+		Remember the next page, after a page has been inserted. Committed with the page.
+
+		The watermark stays pending until the sync is complete: pages come newest first,
+		so older transactions may still be missing.
+		"""
+		values = {"page": (self.page or 0) + 1, "url": url, "offset": offset}
+		if watermark and watermark.date:
+			values["pending_watermark"] = watermark.date
+			values["pending_watermark_ids"] = json.dumps(sorted(watermark.transaction_ids))
+
+		self.db_set(values)
+
+	def complete(self, watermark: Optional[Watermark] = None) -> None:
+		self.checkpoint(None, None, watermark)
+		values = {"status": "Completed", "pending_watermark": None, "pending_watermark_ids": None}
+		if self.pending_watermark:
+			values["watermark"] = self.pending_watermark
+			values["watermark_ids"] = self.pending_watermark_ids
+
+		self.db_set(values)
+
+	def reset(self) -> None:
+		"""Start from scratch next time, e.g. if the remembered page can't be fetched anymore."""
+		self.db_set(
+			{
+				"status": None,
+				"url": None,
+				"offset": None,
+				"pending_watermark": None,
+				"pending_watermark_ids": None,
+			}
+		)
+
+
+def get_sync_state(bank_account: str) -> BankAccountSyncState:
+	if frappe.db.exists("Bank Account Sync State", bank_account):
+		return frappe.get_doc("Bank Account Sync State", bank_account)
+
+	return frappe.get_doc(
+		{"doctype": "Bank Account Sync State", "bank_account": bank_account}
+	).insert(ignore_permissions=True)
+
+
+def delete_sync_state(doc, method=None) -> None:
+	"""Delete the sync state of a Bank Account that is deleted. Called via hooks."""
+	frappe.delete_doc("Bank Account Sync State", doc.name, ignore_missing=True, force=True)
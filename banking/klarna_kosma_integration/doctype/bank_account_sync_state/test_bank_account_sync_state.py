@@ -0,0 +1,110 @@
+# Copyright (c) 2024, ALYF GmbH and Contributors
+# See license.txt
+import frappe
+import requests
+from frappe.tests.utils import FrappeTestCase
+
+from banking.connectors.circuit_breaker import CircuitOpenError
+from banking.connectors.transaction_normalizer import Watermark
+from banking.klarna_kosma_integration.admin import is_page_rejected
+from banking.klarna_kosma_integration.doctype.bank_account_sync_state.bank_account_sync_state import (
+	get_sync_state,
+)
+
+BANK = "Sync State Test Bank"
+
+
+class TestBankAccountSyncState(FrappeTestCase):
+	def setUp(self):
+		if not frappe.db.exists("Bank", BANK):
+			frappe.get_doc({"doctype": "Bank", "bank_name": BANK}).insert()
+
+		self.bank_account = frappe.db.exists("Bank Account", {"bank": BANK})
+		if not self.bank_account:
+			self.bank_account = (
+				frappe.get_doc({"doctype": "Bank Account", "account_name": "Sync State", "bank": BANK})
+				.insert()
+				.name
+			)
+
+		frappe.db.delete("Bank Account Sync State", {"bank_account": self.bank_account})
+
+	def test_resume_checkpoint(self):
+		"""Test if an unfinished sync resumes with the page after its last checkpoint"""
+		state = get_sync_state(self.bank_account)
+		self.assertEqual(state.get_resume_point("2024-01-01"), ("2024-01-01", None, None))
+
+		state.checkpoint("url", "page-2")
+		state.checkpoint("url", "page-3")
+
+		state = get_sync_state(self.bank_account)
+		self.assertEqual(state.page, 2)
+		# The start date of the unfinished sync wins, it belongs to the offset
+		self.assertEqual(state.get_resume_point("2024-02-01"), ("2024-01-01", "url", "page-3"))
+
+		state.complete()
+		state = get_sync_state(self.bank_account)
+		self.assertEqual(state.status, "Completed")
+		self.assertEqual(state.get_resume_point("2024-02-01"), ("2024-02-01", None, None))
+
+	def test_reset(self):
+		"""Test if a reset sync starts over instead of resuming"""
+		state = get_sync_state(self.bank_account)
+		state.get_resume_point("2024-01-01")
+		state.checkpoint("url", "page-2")
+		state.reset()
+
+		state = get_sync_state(self.bank_account)
+		self.assertEqual(state.get_resume_point("2024-02-01"), ("2024-02-01", None, None))
+		self.assertEqual(state.page, 0)
+
+	def test_page_rejected(self):
+		"""Test if only a rejected page resets the checkpoint, not outages or rate limits"""
+
+		def http_error(status_code):
+			response = requests.Response()
+			response.status_code = status_code
+			return requests.exceptions.HTTPError(response=response)
+
+		self.assertTrue(is_page_rejected(http_error(400)))
+		self.assertTrue(is_page_rejected(http_error(404)))
+
+		for exc in (
+			http_error(429),
+			http_error(401),
+			http_error(502),
+			http_error(503),
+			requests.exceptions.ConnectionError(),
+			requests.exceptions.ReadTimeout(),
+			CircuitOpenError(30),
+		):
+			self.assertFalse(is_page_rejected(exc), exc)
+
+	def test_watermark_pending_until_complete(self):
+		"""Test if the watermark only moves once all pages of a sync are inserted"""
+		state = get_sync_state(self.bank_account)
+		state.get_resume_point("2024-01-01")
+		watermark = state.get_watermark()
+
+		# Pages come newest first
+		watermark.date, watermark.transaction_ids = "2024-03-31", {"t3"}
+		state.checkpoint("url", "page-2", watermark)
+
+		state.reload()
+		self.assertFalse(state.watermark)
+		self.assertEqual(state.get_watermark().transaction_ids, {"t3"})
+
+		# After a reset, the next sync must not skip the pages that were never fetched
+		state.reset()
+		state.reload()
+		self.assertIsNone(state.get_watermark().date)
+
+		state.get_resume_point("2024-01-01")
+		state.checkpoint("url", "page-2", Watermark("2024-03-31", ["t3"]))
+		state.complete(Watermark("2024-03-31", ["t3"]))
+
+		state.reload()
+		self.assertEqual(str(state.watermark), "2024-03-31")
+		self.assertEqual(state.status, "Completed")
+		self.assertFalse(state.pending_watermark)
+		self.assertEqual(state.get_watermark().transaction_ids, {"t3"})
@@ -0,0 +1,170 @@
+# Copyright (c) 2024, ALYF GmbH and contributors
+# For license information, please see license.txt
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import frappe
+from frappe.query_builder.custom import ConstantColumn
+from frappe.utils import cint, flt, getdate
+
+from banking.klarna_kosma_integration.doctype.bank_reconciliation_tool_beta.bank_reconciliation_tool_beta import (
+	get_allocated_amounts,
+)
+
+
+def normalize_reference(reference_no: Optional[str]) -> str:
+	return (reference_no or "").strip().casefold()
+
+
+class AutoReconcileEngine:
+	"""
+	Match bank transactions to the Payment Entries and Journal Entries with the same
+	reference number, for auto reconciliation.
+
+	The uncleared vouchers of the GL account and date window are loaded once and indexed
+	by direction ("Receive" or "Pay") and reference number, so that every transaction
+	is matched with a lookup instead of its own queries.
+	"""
+
+	def __init__(
+		self,
+		gl_account: str,
+		from_date: str = None,
+		to_date: str = None,
+		filter_by_reference_date: str = None,
+		from_reference_date: str = None,
+		to_reference_date: str = None,
+	) -> None:
+		self.gl_account = gl_account
+		self.from_date, self.to_date = from_date, to_date
+		self.filter_by_reference_date = cint(filter_by_reference_date)
+		self.from_reference_date, self.to_reference_date = from_reference_date, to_reference_date
+		self.vouchers: Dict[Tuple[str, str], List[frappe._dict]] = defaultdict(list)
+		self.load()
+
+	def load(self) -> None:
+		vouchers = self.get_payment_entries() + self.get_journal_entries()
+		allocated_amounts = get_allocated_amounts(self.gl_account, vouchers)
+		for voucher in vouchers:
+			voucher.paid_amount = voucher.amount - allocated_amounts.get(
+				(voucher.doctype, voucher.name), 0
+			)
+			key = (voucher.direction, normalize_reference(voucher.reference_no))
+			self.vouchers[key].append(voucher)
+
+	def match(self, transaction) -> List[frappe._dict]:
+		"""Return the open vouchers with the reference number of `transaction`, best first."""
+		reference = normalize_reference(transaction.reference_number)
+		if not reference:
+			return []
+
+		direction = "Receive" if transaction.deposit > 0.0 else "Pay"
+		candidates = [
+			voucher
+			for voucher in self.vouchers.get((direction, reference), [])
+			if voucher.paid_amount > 0.0
+		]
+		return sorted(candidates, key=lambda voucher: get_rank(transaction, voucher), reverse=True)
+
+	def refresh(self, vouchers: List[frappe._dict]) -> None:
+		"""Update `vouchers` after they were reconciled: drop cleared ones, subtract allocations."""
+		cleared = set()
+		for doctype in {voucher.doctype for voucher in vouchers}:
+			names = [voucher.name for voucher in vouchers if voucher.doctype == doctype]
+			cleared.update(
+				(doctype, name)
+				for name in frappe.get_all(
+					doctype,
+					filters={"name": ["in", names], "clearance_date": ["is", "set"]},
+					pluck="name",
+				)
+			)
+
+		allocated_amounts = get_allocated_amounts(self.gl_account, vouchers)
+		for voucher in vouchers:
+			key = (voucher.doctype, voucher.name)
+			voucher.paid_amount = (
+				0.0 if key in cleared else voucher.amount - allocated_amounts.get(key, 0)
+			)
+
+	def get_payment_entries(self) -> List[frappe._dict]:
+		pe = frappe.qb.DocType("Payment Entry")
+		receive = (pe.paid_to == self.gl_account) & pe.payment_type.isin(
+			["Receive", "Internal Transfer"]
+		)
+		pay = (pe.paid_from == self.gl_account) & pe.payment_type.isin(
+			["Pay", "Internal Transfer"]
+		)
+
+		return (
+			frappe.qb.from_(pe)
+			.select(
+				ConstantColumn("Payment Entry").as_("doctype"),
+				pe.name,
+				pe.paid_amount.as_("amount"),
+				frappe.qb.terms.Case().when(receive, "Receive").else_("Pay").as_("direction"),
+				pe.reference_no,
+				pe.reference_date,
+				pe.posting_date,
+				pe.party_type,
+				pe.party,
+			)
+			.where(pe.docstatus == 1)
+			.where(pe.clearance_date.isnull())
+			.where(receive | pay)
+			.where(pe.paid_amount > 0.0)
+			.where(pe.reference_no.isnotnull() & (pe.reference_no != ""))
+			.where(self.get_date_condition(pe.posting_date, pe.reference_date))
+			.orderby(pe.reference_date if self.filter_by_reference_date else pe.posting_date)
+		).run(as_dict=True)
+
+	def get_journal_entries(self) -> List[frappe._dict]:
+		je = frappe.qb.DocType("Journal Entry")
+		jea = frappe.qb.DocType("Journal Entry Account")
+		receive = jea.debit_in_account_currency > 0.0
+
+		return (
+			frappe.qb.from_(jea)
+			.join(je)
+			.on(jea.parent == je.name)
+			.select(
+				ConstantColumn("Journal Entry").as_("doctype"),
+				je.name,
+				frappe.qb.terms.Case()
+				.when(receive, jea.debit_in_account_currency)
+				.else_(jea.credit_in_account_currency)
+				.as_("amount"),
+				frappe.qb.terms.Case().when(receive, "Receive").else_("Pay").as_("direction"),
+				je.cheque_no.as_("reference_no"),
+				je.cheque_date.as_("reference_date"),
+				je.posting_date,
+			)
+			.where(je.docstatus == 1)
+			.where(je.voucher_type != "Opening Entry")
+			.where(je.clearance_date.isnull())
+			.where(jea.account == self.gl_account)
+			.where(receive | (jea.credit_in_account_currency > 0.0))
+			.where(je.cheque_no.isnotnull() & (je.cheque_no != ""))
+			.where(self.get_date_condition(je.posting_date, je.cheque_date))
+			.orderby(je.cheque_date if self.filter_by_reference_date else je.posting_date)
+		).run(as_dict=True)
+
+	def get_date_condition(self, posting_date, reference_date):
+		if self.filter_by_reference_date:
+			return reference_date.between(self.from_reference_date, self.to_reference_date)
+
+		return posting_date.between(self.from_date, self.to_date)
+
+
+def get_rank(transaction, voucher: frappe._dict) -> int:
+	"""Rank like the matching queries: amount, party and date matches count."""
+	amount_match = flt(voucher.amount) == flt(transaction.unallocated_amount)
+	party_match = bool(
+		voucher.party
+		and voucher.party_type == transaction.party_type
+		and voucher.party == transaction.party
+	)
+	date_match = getdate(voucher.reference_date or voucher.posting_date) == getdate(
+		transaction.date
+	)
+	return 1 + amount_match + party_match + date_match
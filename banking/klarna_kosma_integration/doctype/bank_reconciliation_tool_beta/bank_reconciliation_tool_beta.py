@@ -7,20 +7,46 @@ import frappe
 from frappe import _
 from frappe.model.document import Document
 from frappe.query_builder.custom import ConstantColumn
-from frappe.query_builder.functions import Coalesce
-from frappe.utils import cint, flt
+from frappe.query_builder.functions import Coalesce, Sum
+from frappe.utils import cint, flt, getdate
 from pypika.terms import Parameter
 
 from erpnext import get_company_currency, get_default_cost_center
-from erpnext.accounts.doctype.bank_transaction.bank_transaction import (
-	BankTransaction,
-	get_total_allocated_amount,
-)
+from erpnext.accounts.doctype.bank_transaction.bank_transaction import BankTransaction
 from erpnext.accounts.doctype.bank_reconciliation_tool.bank_reconciliation_tool import (
 	reconcile_vouchers,
 )
 from erpnext.accounts.utils import get_account_currency
 
+from banking.klarna_kosma_integration.doctype.bank_reconciliation_tool_beta.voucher_scoring import (
+	ScoringWeights,
+	get_candidates,
+	score,
+	top_k,
+)
+
+MATCHING_QUERIES_HOOK = f"{__name__}.get_matching_queries"
+# Columns selected by all matching queries of this app, in this order, to combine them
+MATCH_COLUMNS = (
+	"rank",
+	"doctype",
+	"name",
+	"paid_amount",
+	"reference_no",
+	"reference_date",
+	"party",
+	"party_type",
+	"posting_date",
+	"currency",
+	"reference_number_match",
+	"amount_match",
+	"party_match",
+	"date_match",
+	"unallocated_amount_match",
+)
+MAX_MATCHING_VOUCHERS = 100
+MAX_SCORED_VOUCHERS = 2000  # candidates of a non-exact match, before the best are picked
+
 
 class BankReconciliationToolBeta(Document):
 	pass
@@ -289,22 +315,26 @@ def auto_reconcile_vouchers(
 	from_reference_date: str = None,
 	to_reference_date: str = None,
 ):
+	# imported here as it imports from this module
+	from banking.klarna_kosma_integration.doctype.bank_reconciliation_tool_beta.auto_reconcile import (
+		AutoReconcileEngine,
+	)
+
 	# Auto reconcile vouchers with matching reference numbers
 	frappe.flags.auto_reconcile_vouchers = True
 	reconciled, partially_reconciled = set(), set()
 
+	engine = AutoReconcileEngine(
+		frappe.db.get_value("Bank Account", bank_account, "account"),
+		from_date,
+		to_date,
+		filter_by_reference_date,
+		from_reference_date,
+		to_reference_date,
+	)
 	bank_transactions = get_bank_transactions(bank_account, from_date, to_date)
 	for transaction in bank_transactions:
-		linked_payments = get_linked_payments(
-			transaction.name,
-			["payment_entry", "journal_entry"],
-			from_date,
-			to_date,
-			filter_by_reference_date,
-			from_reference_date,
-			to_reference_date,
-		)
-
+		linked_payments = engine.match(transaction)
 		if not linked_payments:
 			continue
 
@@ -321,6 +351,7 @@ def auto_reconcile_vouchers(
 
 		unallocated_before = transaction.unallocated_amount
 		transaction = reconcile_vouchers(transaction.name, json.dumps(vouchers))
+		engine.refresh(linked_payments)
 
 		if transaction.status == "Reconciled":
 			reconciled.add(transaction.name)
@@ -382,20 +413,97 @@ def get_linked_payments(
 		from_reference_date,
 		to_reference_date,
 	)
-	return subtract_allocations(gl_account, matching)
+	return rank_matches(gl_account, transaction, matching, document_types)
+
+
+@frappe.whitelist()
+def get_linked_payments_for_transactions(
+	bank_transaction_names: Union[str, list],
+	document_types: Union[str, list] = None,
+	from_date: str = None,
+	to_date: str = None,
+	filter_by_reference_date: str = None,
+	from_reference_date: str = None,
+	to_reference_date: str = None,
+) -> dict:
+	"""
+	Return the matching payments of many bank transactions, keyed by bank transaction.
+	The transactions and their bank accounts are fetched once for all of them.
+	"""
+	if isinstance(bank_transaction_names, str):
+		bank_transaction_names = json.loads(bank_transaction_names)
+	if isinstance(document_types, str):
+		document_types = json.loads(document_types)
+
+	document_types = document_types or []
+	if not bank_transaction_names:
+		return {}
+
+	transactions = frappe.get_list(
+		"Bank Transaction",
+		filters={"name": ["in", bank_transaction_names]},
+		fields=[
+			"name",
+			"bank_account",
+			"date",
+			"deposit",
+			"withdrawal",
+			"unallocated_amount",
+			"currency",
+			"reference_number",
+			"description",
+			"party_type",
+			"party",
+		],
+	)
+	bank_accounts = {
+		account.name: account
+		for account in frappe.get_all(
+			"Bank Account",
+			filters={"name": ["in", list({row.bank_account for row in transactions})]},
+			fields=["name", "account", "company"],
+		)
+	}
+
+	linked_payments = {}
+	for transaction in transactions:
+		bank_account = bank_accounts[transaction.bank_account]
+		matching = check_matching(
+			bank_account.account,
+			bank_account.company,
+			transaction,
+			document_types,
+			from_date,
+			to_date,
+			filter_by_reference_date,
+			from_reference_date,
+			to_reference_date,
+		)
+		linked_payments[transaction.name] = rank_matches(
+			bank_account.account, transaction, matching, document_types
+		)
+
+	return linked_payments
+
+
+def rank_matches(gl_account, transaction, vouchers: list, document_types: list) -> list:
+	"""
+	Subtract existing allocations from the matching vouchers. A non-exact match is then
+	scored by what is left to allocate.
+	"""
+	vouchers = subtract_allocations(gl_account, vouchers)
+	if "exact_match" not in document_types:
+		return score_vouchers(transaction, vouchers)
+
+	return vouchers
 
 
 def subtract_allocations(gl_account, vouchers):
 	"Look up & subtract any existing Bank Transaction allocations"
+	allocated_amounts = get_allocated_amounts(gl_account, vouchers)
 	copied = []
 	for voucher in vouchers:
-		rows = get_total_allocated_amount(voucher.get("doctype"), voucher.get("name"))
-		amount = None
-		for row in rows:
-			if row["gl_account"] == gl_account:
-				amount = row["total"]
-				break
-
+		amount = allocated_amounts.get((voucher.get("doctype"), voucher.get("name")))
 		if amount:
 			voucher["paid_amount"] -= amount
 
@@ -403,6 +511,34 @@ def subtract_allocations(gl_account, vouchers):
 	return copied
 
 
+def get_allocated_amounts(gl_account, vouchers) -> dict:
+	"""
+	Return the amounts of `vouchers` allocated to submitted Bank Transactions of
+	`gl_account`, by (doctype, name). One query for all vouchers.
+	"""
+	if not vouchers:
+		return {}
+
+	btp = frappe.qb.DocType("Bank Transaction Payments")
+	bt = frappe.qb.DocType("Bank Transaction")
+	ba = frappe.qb.DocType("Bank Account")
+	rows = (
+		frappe.qb.from_(btp)
+		.join(bt)
+		.on(bt.name == btp.parent)
+		.join(ba)
+		.on(ba.name == bt.bank_account)
+		.select(btp.payment_document, btp.payment_entry, Sum(btp.allocated_amount))
+		.where(bt.docstatus == 1)
+		.where(ba.account == gl_account)
+		.where(btp.payment_document.isin(list({voucher.get("doctype") for voucher in vouchers})))
+		.where(btp.payment_entry.isin(list({voucher.get("name") for voucher in vouchers})))
+		.groupby(btp.payment_document, btp.payment_entry)
+	).run()
+
+	return {(doctype, name): flt(total) for doctype, name, total in rows}
+
+
 def check_matching(
 	bank_account,
 	company,
@@ -434,6 +570,7 @@ def check_matching(
 		"party": transaction.party,
 		"bank_account": bank_account,
 		"date": transaction.date,
+		"description": transaction.description,
 	}
 
 	matching_vouchers = []
@@ -451,6 +588,9 @@ def check_matching(
 
 	if transaction.description:
 		for voucher in matching_vouchers:
+			if "name_in_desc_match" in voucher:
+				continue  # ranked by the combined query
+
 			# higher rank if voucher name is in bank transaction
 			reference_no = voucher["reference_no"]
 			if reference_no and (reference_no.strip() in transaction.description):
@@ -460,6 +600,50 @@ def check_matching(
 	return sorted(matching_vouchers, key=lambda x: x["rank"], reverse=True)
 
 
+def score_vouchers(transaction, vouchers: list) -> list:
+	"""
+	Return the best vouchers of a non-exact match, by how close their amount, date,
+	party and reference are to the bank transaction. Weighted as set in Banking Settings.
+	"""
+	if not vouchers:
+		return vouchers
+
+	settings = frappe.get_cached_doc("Banking Settings")
+	weights = ScoringWeights(
+		amount=flt(settings.match_amount_weight),
+		date=flt(settings.match_date_weight),
+		party=flt(settings.match_party_weight),
+		reference=flt(settings.match_reference_weight),
+	)
+
+	candidates = get_candidates(
+		flt(transaction.unallocated_amount),
+		getdate(transaction.date),
+		*get_columns(
+			vouchers,
+			"paid_amount",
+			"reference_date",
+			"posting_date",
+			"party_match",
+			"reference_number_match",
+			"name_in_desc_match",
+		),
+	)
+
+	scores = score(candidates, weights)
+	best = []
+	for index in top_k(scores, cint(settings.match_top_k)):
+		vouchers[index]["score"] = scores[index]
+		best.append(vouchers[index])
+
+	return best
+
+
+def get_columns(vouchers: list, *columns: str) -> list:
+	"""Return the values of each of `columns`, for all `vouchers`."""
+	return [[voucher.get(column) for voucher in vouchers] for column in columns]
+
+
 def get_queries(
 	bank_account,
 	company,
@@ -478,7 +662,7 @@ def get_queries(
 
 	# get matching queries from all the apps (except erpnext, to override)
 	for method_name in frappe.get_hooks("get_matching_queries")[1:]:
-		queries.extend(
+		app_queries = (
 			frappe.get_attr(method_name)(
 				bank_account,
 				company,
@@ -494,10 +678,39 @@ def get_queries(
 			)
 			or []
 		)
+		if method_name == MATCHING_QUERIES_HOOK and app_queries:
+			limit = MAX_MATCHING_VOUCHERS if exact_match else MAX_SCORED_VOUCHERS
+			app_queries = [combine_matching_queries(app_queries, limit)]
+
+		queries.extend(app_queries)
 
 	return queries
 
 
+def combine_matching_queries(queries: list, limit: int = MAX_MATCHING_VOUCHERS) -> str:
+	"""
+	Combine the matching queries of this app into one UNION ALL query, ranked and limited
+	in the database. Vouchers whose reference number is in the bank transaction's
+	description rank higher, like in `check_matching`.
+	"""
+	union = " UNION ALL ".join(f"({query})" for query in queries if query)
+	name_in_desc_match = (
+		"CASE WHEN matches.reference_no <> '' "
+		"AND POSITION(TRIM(matches.reference_no) IN %(description)s) > 0 THEN 1 ELSE 0 END"
+	)
+	columns = ", ".join(f"matches.`{column}`" for column in MATCH_COLUMNS[1:])
+
+	return f"""
+		SELECT
+			matches.`rank` + {name_in_desc_match} AS `rank`,
+			{columns},
+			{name_in_desc_match} AS name_in_desc_match
+		FROM ({union}) AS matches
+		ORDER BY `rank` DESC
+		LIMIT {cint(limit)}
+	"""
+
+
 def get_matching_queries(
 	bank_account,
 	company,
@@ -630,6 +843,7 @@ def get_bt_matching_query(exact_match, transaction, exact_party_match):
 			ref_rank.as_("reference_number_match"),
 			amount_rank.as_("amount_match"),
 			party_rank.as_("party_match"),
+			ConstantColumn(0).as_("date_match"),
 			unallocated_rank.as_("unallocated_amount_match"),
 		)
 		.where(bt.status != "Reconciled")
@@ -677,8 +891,10 @@ def get_ld_matching_query(bank_account, exact_match, transaction):
 			loan_disbursement.disbursement_date.as_("posting_date"),
 			ConstantColumn("").as_("currency"),
 			reference_rank.as_("reference_number_match"),
+			ConstantColumn(0).as_("amount_match"),
 			party_rank.as_("party_match"),
 			date_rank.as_("date_match"),
+			ConstantColumn(0).as_("unallocated_amount_match"),
 		)
 		.where(loan_disbursement.docstatus == 1)
 		.where(loan_disbursement.clearance_date.isnull())
@@ -725,8 +941,10 @@ def get_lr_matching_query(bank_account, exact_match, transaction):
 			loan_repayment.posting_date,
 			ConstantColumn("").as_("currency"),
 			reference_rank.as_("reference_number_match"),
+			ConstantColumn(0).as_("amount_match"),
 			party_rank.as_("party_match"),
 			date_rank.as_("date_match"),
+			ConstantColumn(0).as_("unallocated_amount_match"),
 		)
 		.where(loan_repayment.docstatus == 1)
 		.where(loan_repayment.clearance_date.isnull())
@@ -798,6 +1016,7 @@ def get_pe_matching_query(
 			amount_rank.as_("amount_match"),
 			party_rank.as_("party_match"),
 			date_rank.as_("date_match"),
+			ConstantColumn(0).as_("unallocated_amount_match"),
 		)
 		.where(pe.docstatus == 1)
 		.where(pe.payment_type.isin([payment_type, "Internal Transfer"]))
@@ -864,7 +1083,9 @@ def get_je_matching_query(
 			jea.account_currency.as_("currency"),
 			ref_rank.as_("reference_number_match"),
 			amount_rank.as_("amount_match"),
+			ConstantColumn(0).as_("party_match"),
 			date_rank.as_("date_match"),
+			ConstantColumn(0).as_("unallocated_amount_match"),
 		)
 		.where(je.docstatus == 1)
 		.where(je.voucher_type != "Opening Entry")
@@ -912,9 +1133,11 @@ def get_si_matching_query(exact_match, exact_party_match, currency):
 			ConstantColumn("Customer").as_("party_type"),
 			si.posting_date,
 			si.currency,
-			party_rank.as_("party_match"),
+			ConstantColumn(0).as_("reference_number_match"),
 			amount_rank.as_("amount_match"),
+			party_rank.as_("party_match"),
 			date_rank.as_("date_match"),
+			ConstantColumn(0).as_("unallocated_amount_match"),
 		)
 		.where(si.docstatus == 1)
 		.where(sip.clearance_date.isnull())
@@ -953,8 +1176,11 @@ def get_unpaid_si_matching_query(exact_match, exact_party_match, currency, compa
 			ConstantColumn("Customer").as_("party_type"),
 			sales_invoice.posting_date,
 			sales_invoice.currency,
-			party_match.as_("party_match"),
+			ConstantColumn(0).as_("reference_number_match"),
 			amount_match.as_("amount_match"),
+			party_match.as_("party_match"),
+			ConstantColumn(0).as_("date_match"),
+			ConstantColumn(0).as_("unallocated_amount_match"),
 		)
 		.where(sales_invoice.docstatus == 1)
 		.where(sales_invoice.company == company)
@@ -1003,9 +1229,11 @@ def get_pi_matching_query(exact_match, exact_party_match, currency):
 			ConstantColumn("Supplier").as_("party_type"),
 			purchase_invoice.posting_date,
 			purchase_invoice.currency,
-			party_rank.as_("party_match"),
+			ConstantColumn(0).as_("reference_number_match"),
 			amount_rank.as_("amount_match"),
+			party_rank.as_("party_match"),
 			date_rank.as_("date_match"),
+			ConstantColumn(0).as_("unallocated_amount_match"),
 		)
 		.where(purchase_invoice.docstatus == 1)
 		.where(purchase_invoice.is_paid == 1)
@@ -1045,8 +1273,11 @@ def get_unpaid_pi_matching_query(exact_match, exact_party_match, currency, compa
 			ConstantColumn("Supplier").as_("party_type"),
 			purchase_invoice.posting_date,
 			purchase_invoice.currency,
-			party_match.as_("party_match"),
+			ConstantColumn(0).as_("reference_number_match"),
 			amount_match.as_("amount_match"),
+			party_match.as_("party_match"),
+			ConstantColumn(0).as_("date_match"),
+			ConstantColumn(0).as_("unallocated_amount_match"),
 		)
 		.where(purchase_invoice.docstatus == 1)
 		.where(purchase_invoice.company == company)
@@ -1095,8 +1326,11 @@ def get_unpaid_ec_matching_query(exact_match, exact_party_match, currency, compa
 			ConstantColumn("Employee").as_("party_type"),
 			expense_claim.posting_date,
 			ConstantColumn(currency).as_("currency"),
-			party_match.as_("party_match"),
+			ConstantColumn(0).as_("reference_number_match"),
 			amount_match.as_("amount_match"),
+			party_match.as_("party_match"),
+			ConstantColumn(0).as_("date_match"),
+			ConstantColumn(0).as_("unallocated_amount_match"),
 		)
 		.where(expense_claim.docstatus == 1)
 		.where(expense_claim.company == company)
@@ -1,18 +1,67 @@
 # Copyright (c) 2023, ALYF GmbH and Contributors
 # See license.txt
 
-# import frappe
+import json
+
+import frappe
 from frappe.tests.utils import FrappeTestCase
+from frappe.utils import nowdate
 
 from erpnext.accounts.test.accounts_mixin import AccountsTestMixin
 
+from banking.klarna_kosma_integration.doctype.bank_reconciliation_tool_beta.bank_reconciliation_tool_beta import (
+	get_linked_payments_for_transactions,
+)
+
+BANK = "Reconciliation Test Bank"
+
 # from erpnext.accounts.doctype.bank_reconciliation_tool.bank_reconciliation_tool import reconcile_vouchers
 # from erpnext.accounts.doctype.bank_transaction.test_bank_transaction import create_bank_account
 # from erpnext.accounts.doctype.sales_invoice.test_sales_invoice import create_sales_invoice
 
 
 class TestBankReconciliationToolBeta(AccountsTestMixin, FrappeTestCase):
-	pass
+	def setUp(self):
+		if not frappe.db.exists("Bank", BANK):
+			frappe.get_doc({"doctype": "Bank", "bank_name": BANK}).insert()
+
+		bank_account = frappe.db.exists("Bank Account", {"bank": BANK})
+		if not bank_account:
+			bank_account = (
+				frappe.get_doc(
+					{
+						"doctype": "Bank Account",
+						"account_name": "Reconciliation",
+						"bank": BANK,
+						"account": "_Test Bank - _TC",
+						"company": "_Test Company",
+						"is_company_account": 1,
+					}
+				)
+				.insert()
+				.name
+			)
+
+		self.bank_transaction = frappe.get_doc(
+			{
+				"doctype": "Bank Transaction",
+				"bank_account": bank_account,
+				"date": nowdate(),
+				"deposit": 50,
+				"currency": "INR",
+				"description": "Test payment",
+			}
+		).insert()
+		self.bank_transaction.submit()
+
+	def test_linked_payments_without_document_types(self):
+		"""Test if matching many transactions works without any document types"""
+		names = json.dumps([self.bank_transaction.name])
+		for document_types in (None, "[]"):
+			linked_payments = get_linked_payments_for_transactions(names, document_types)
+			self.assertEqual(linked_payments, {self.bank_transaction.name: []})
+
+		self.assertEqual(get_linked_payments_for_transactions("[]"), {})
 
 
 # def setUp(self):
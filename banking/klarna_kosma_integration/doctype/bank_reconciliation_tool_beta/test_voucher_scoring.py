@@ -0,0 +1,71 @@
+# Copyright (c) 2024, ALYF GmbH and Contributors
+# See license.txt
+import unittest
+from datetime import date
+from unittest.mock import patch
+
+from banking.klarna_kosma_integration.doctype.bank_reconciliation_tool_beta import (
+	voucher_scoring,
+)
+from banking.klarna_kosma_integration.doctype.bank_reconciliation_tool_beta.voucher_scoring import (
+	Candidates,
+	ScoringWeights,
+	get_candidates,
+	score,
+	top_k,
+)
+
+CANDIDATES = Candidates(
+	amount_deltas=[0.0, 0.5, 0.0, 3.0],
+	date_deltas=[14, 0, 0, 7],
+	party_matches=[0, 1, 1, 0],
+	reference_matches=[1.0, 0.0, 0.0, 0.0],
+)
+COLUMNS = (
+	[100.0, 150.0, None],  # paid amounts, after allocations
+	[date(2024, 1, 8), None, None],  # reference dates
+	[date(2024, 1, 1), date(2024, 1, 1), date(2024, 1, 4)],  # posting dates
+	[1, 0, None],  # party matches
+	[0, 1, None],  # reference number matches
+	[1, 0, None],  # name in description matches
+)
+
+
+class TestVoucherScoring(unittest.TestCase):
+	def test_score(self):
+		scores = score(CANDIDATES, ScoringWeights())
+
+		self.assertAlmostEqual(scores[2], 3.0)  # same amount, date and party
+		self.assertAlmostEqual(scores[3], 0.25 + 0.5)
+		self.assertEqual(top_k(scores), [2, 1, 0, 3])
+		self.assertEqual(top_k(scores, 2), [2, 1])
+
+	def test_weights(self):
+		scores = score(CANDIDATES, ScoringWeights(amount=0, date=0, party=0, reference=5))
+		self.assertEqual(top_k(scores, 1), [0])
+
+	def test_without_numpy(self):
+		weights = ScoringWeights(amount=2, date=0.5)
+		expected = score(CANDIDATES, weights)
+
+		with patch.object(voucher_scoring, "numpy", None):
+			scores = score(CANDIDATES, weights)
+			for actual, value in zip(scores, expected):
+				self.assertAlmostEqual(actual, value)
+
+			self.assertEqual(top_k(scores, 3), top_k(expected, 3))
+
+	def test_get_candidates(self):
+		candidates = get_candidates(100.0, date(2024, 1, 2), *COLUMNS)
+
+		self.assertEqual(list(candidates.amount_deltas), [0.0, 0.5, -1.0])
+		# The reference date counts, else the posting date
+		self.assertEqual(list(candidates.date_deltas), [6, -1, 2])
+		self.assertEqual(list(candidates.party_matches), [1, 0, 0])
+		self.assertEqual(list(candidates.reference_matches), [1, 1, 0])
+
+		with patch.object(voucher_scoring, "numpy", None):
+			self.assertEqual(
+				[list(feature) for feature in get_candidates(100.0, date(2024, 1, 2), *COLUMNS)],
+				[list(feature) for feature in candidates],
+			)
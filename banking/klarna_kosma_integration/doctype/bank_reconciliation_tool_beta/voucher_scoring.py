@@ -0,0 +1,115 @@
+# Copyright (c) 2024, ALYF GmbH and contributors
+# For license information, please see license.txt
+import heapq
+from datetime import date
+from typing import List, NamedTuple, Optional, Sequence
+
+try:
+	import numpy
+except ImportError:  # optional, candidates are scored in plain Python then
+	numpy = None
+
+DATE_SCALE = 7  # days, a voucher this far from the transaction gets half the date score
+
+
+class ScoringWeights(NamedTuple):
+	amount: float = 1.0
+	date: float = 1.0
+	party: float = 1.0
+	reference: float = 1.0
+
+
+class Candidates(NamedTuple):
+	"""Features of the candidate vouchers of a bank transaction, one sequence per feature."""
+
+	amount_deltas: Sequence[float]  # relative to the amount of the transaction
+	date_deltas: Sequence[int]  # in days
+	party_matches: Sequence[int]
+	reference_matches: Sequence[float]  # between 0 and 1
+
+
+def get_candidates(
+	transaction_amount: float,
+	transaction_date: date,
+	paid_amounts: Sequence[Optional[float]],
+	reference_dates: Sequence[Optional[date]],
+	posting_dates: Sequence[date],
+	party_matches: Sequence[Optional[int]],
+	reference_number_matches: Sequence[Optional[int]],
+	name_in_desc_matches: Sequence[Optional[int]],
+) -> Candidates:
+	"""
+	Return the features of the candidate vouchers, computed from their columns. A voucher's
+	reference date counts if it has one, else its posting date. Missing values count as 0.
+	"""
+	amount = transaction_amount or 1.0
+	if numpy is not None:
+		dates = numpy.asarray(reference_dates, dtype="datetime64[D]")
+		dates = numpy.where(
+			numpy.isnat(dates), numpy.asarray(posting_dates, dtype="datetime64[D]"), dates
+		)
+		return Candidates(
+			amount_deltas=(numpy.nan_to_num(numpy.asarray(paid_amounts, dtype=float)) - amount)
+			/ amount,
+			date_deltas=(dates - numpy.datetime64(transaction_date, "D")).astype(int),
+			party_matches=numpy.nan_to_num(numpy.asarray(party_matches, dtype=float)),
+			reference_matches=numpy.nan_to_num(
+				numpy.fmax(
+					numpy.asarray(reference_number_matches, dtype=float),
+					numpy.asarray(name_in_desc_matches, dtype=float),
+				)
+			),
+		)
+
+	return Candidates(
+		amount_deltas=[((paid_amount or 0) - amount) / amount for paid_amount in paid_amounts],
+		date_deltas=[
+			((reference_date or voucher_date) - transaction_date).days
+			for reference_date, voucher_date in zip(reference_dates, posting_dates)
+		],
+		party_matches=[party_match or 0 for party_match in party_matches],
+		reference_matches=[
+			max(reference_match or 0, name_match or 0)
+			for reference_match, name_match in zip(reference_number_matches, name_in_desc_matches)
+		],
+	)
+
+
+def score(candidates: Candidates, weights: ScoringWeights) -> List[float]:
+	"""
+	Return the score of every candidate: the weighted sum of its amount, date, party and
+	reference similarity, each between 0 and 1.
+	"""
+	if numpy is not None:
+		amount = 1 / (1 + numpy.abs(numpy.asarray(candidates.amount_deltas, dtype=float)))
+		date = 1 / (
+			1 + numpy.abs(numpy.asarray(candidates.date_deltas, dtype=float)) / DATE_SCALE
+		)
+		scores = (
+			weights.amount * amount
+			+ weights.date * date
+			+ weights.party * numpy.asarray(candidates.party_matches, dtype=float)
+			+ weights.reference * numpy.asarray(candidates.reference_matches, dtype=float)
+		)
+		return scores.tolist()
+
+	return [
+		weights.amount / (1 + abs(amount_delta))
+		+ weights.date / (1 + abs(date_delta) / DATE_SCALE)
+		+ weights.party * party_match
+		+ weights.reference * reference_match
+		for amount_delta, date_delta, party_match, reference_match in zip(*candidates)
+	]
+
+
+def top_k(scores: List[float], k: int = 0) -> List[int]:
+	"""Return the indexes of the `k` best scores, best first. All of them if `k` is 0."""
+	if not k or k >= len(scores):
+		return sorted(range(len(scores)), key=scores.__getitem__, reverse=True)
+
+	if numpy is not None:
+		array = numpy.asarray(scores)
+		best = numpy.sort(numpy.argpartition(-array, k - 1)[:k])
+		return best[numpy.argsort(-array[best], kind="stable")].tolist()
+
+	return heapq.nlargest(k, range(len(scores)), key=scores.__getitem__)
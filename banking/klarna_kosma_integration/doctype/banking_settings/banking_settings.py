@@ -8,18 +8,21 @@ import frappe
 from frappe import _
 from frappe.model.document import Document
 
-from banking.klarna_kosma_integration.admin import Admin
-from banking.klarna_kosma_integration.exception_handler import BankingError
+from banking.klarna_kosma_integration.admin import Admin, enqueue_sync
+from banking.klarna_kosma_integration.admin_config import clear_admin_config
+from banking.klarna_kosma_integration.scheduled_sync import enqueue_account_syncs
 from banking.klarna_kosma_integration.utils import (
 	create_bank_account,
 	needs_consent,
 	update_bank_account,
 	update_bank,
+	update_kosma_account_ids,
 )
 
 
 class BankingSettings(Document):
-	pass
+	def on_update(self):
+		clear_admin_config()
 
 
 @frappe.whitelist()
@@ -75,12 +78,15 @@ def sync_transactions(account: str, session_id_short: Optional[str] = None) -> N
 			title=_("Kosma Error"),
 		)
 
-	frappe.enqueue(
-		"banking.klarna_kosma_integration.admin.sync_kosma_transactions",
-		account=account,
-		session_id_short=session_id_short,
-		now=frappe.conf.developer_mode,
-	)
+	if not enqueue_sync(account, session_id_short):
+		frappe.msgprint(
+			_("A Transaction Sync for Bank Account {0} is already queued.").format(
+				frappe.bold(account)
+			),
+			alert=True,
+			indicator="orange",
+		)
+		return
 
 	frappe.msgprint(
 		_(
@@ -95,24 +101,22 @@ def sync_transactions(account: str, session_id_short: Optional[str] = None) -> N
 def sync_all_accounts_and_transactions():
 	"""
 	Refresh all Bank accounts and enqueue their transactions sync, via the Consent API.
-	Called via hooks.
+	Called via hooks. The results are collected in the Last Sync Summary.
 	"""
 	if not frappe.db.get_single_value("Banking Settings", "enabled"):
 		return
 
-	accounts_list = []
-
-	for bank, company in frappe.get_all(
-		"Bank Consent", fields=["bank", "company"], as_list=True
-	):
-		accounts = get_bank_accounts_to_sync(bank, company)
-		for account in accounts:
-			bank_account = frappe.db.exists("Bank Account", {"iban": account.get("iban")})
-			if not bank_account:
-				continue
+	consents = [
+		(bank, company)
+		for bank, company in frappe.get_all("Bank Consent", fields=["bank", "company"], as_list=True)
+		if not needs_consent(bank, company)
+	]
+	if not consents:
+		return
 
-			update_bank_account(account, bank_account)
-			accounts_list.append(bank_account)
+	accounts_list = []
+	for (bank, company), accounts in Admin().consent_accounts_concurrently(consents).items():
+		accounts_list.extend(update_kosma_account_ids(accounts))
 
 		if not accounts:
 			accounts_list.extend(
@@ -127,18 +131,8 @@ def sync_all_accounts_and_transactions():
 				)
 			)
 
-	for bank_account in accounts_list:
-		sync_transactions(account=bank_account)
-
-
-def get_bank_accounts_to_sync(bank: str, company: str) -> list:
-	"""
-	Get bank accounts from Kosma via the consent API.
-	"""
-	try:
-		return Admin().consent_accounts(bank, company)
-	except BankingError:
-		return []
+	if accounts_list:
+		enqueue_account_syncs(accounts_list)
 
 
 @frappe.whitelist()
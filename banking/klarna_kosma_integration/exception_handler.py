@@ -4,11 +4,17 @@ import requests
 import frappe
 from frappe import _
 
+from banking.connectors.circuit_breaker import CircuitOpenError
+
 
 class BankingError(frappe.ValidationError):
 	pass
 
 
+class AdminUnavailableError(BankingError):
+	pass
+
+
 class ExceptionHandler:
 	"""
 	Log and throw error as received from Admin app.
@@ -19,6 +25,8 @@ class ExceptionHandler:
 		self.handle_error()
 
 	def handle_error(self):
+		self.handle_circuit_open()
+
 		if not isinstance(self.exception, requests.exceptions.HTTPError):
 			frappe.log_error(title=_("Banking Error"), message=frappe.get_traceback())
 			raise
@@ -32,6 +40,21 @@ class ExceptionHandler:
 		self.handle_frappe_server_error(content, response)
 		self.handle_admin_error(content)
 
+	def handle_circuit_open(self):
+		"""
+		Handle requests that were not sent because the Admin app is down.
+
+		Not logged, the failures that opened the circuit have been logged already.
+		"""
+		if not isinstance(self.exception, CircuitOpenError):
+			return
+
+		frappe.throw(
+			title=_("Banking Error"),
+			msg=_("The Banking service is currently unavailable. Please retry in a few minutes."),
+			exc=AdminUnavailableError,
+		)
+
 	def handle_auth_error(self, response):
 		if not response.status_code == 401:
 			return
@@ -0,0 +1,201 @@
+# Copyright (c) 2024, ALYF GmbH and contributors
+# For license information, please see license.txt
+import json
+from typing import Dict, List, Optional
+
+import frappe
+from frappe.utils import now_datetime
+
+from banking.klarna_kosma_integration.admin import (
+	DEFERRED_SYNCS_KEY,
+	SYNC_LOCK_TIMEOUT,
+	Admin,
+	enqueue_sync,
+	sync_lock,
+)
+from banking.klarna_kosma_integration.admin_config import get_admin_config
+from banking.klarna_kosma_integration.exception_handler import AdminUnavailableError
+from banking.klarna_kosma_integration.utils import account_last_sync_date
+
+SYNC_RUN_TTL = 24 * 60 * 60  # seconds, results of runs that never finish expire
+PENDING_SYNCS_KEY = "banking_pending_syncs"
+DEFERRED_RUN_SYNCS_KEY = "banking_deferred_run_syncs"
+LATEST_RUN_KEY = "banking_latest_sync_run"
+
+
+def enqueue_account_syncs(accounts: List[str]) -> None:
+	"""
+	Sync the transactions of `accounts` as one run, one background job per account.
+
+	All accounts are queued in Redis at once, so that no job has to hand over the rest
+	of the run. A job is only enqueued for a free slot, i.e. the queue never holds more
+	sync jobs than may run at the same time. Accounts sharing a consent are never synced
+	at the same time, as every response rotates the consent token.
+	"""
+	run = frappe.generate_hash(length=10)
+	entries = [
+		json.dumps([run, account, f"{bank}|{company}"])
+		for account, bank, company in frappe.get_all(
+			"Bank Account",
+			filters={"name": ["in", accounts]},
+			fields=["name", "bank", "company"],
+			as_list=True,
+		)
+	]
+	if not entries:
+		return
+
+	cache = frappe.cache()
+	cache.set_value(
+		get_run_key(run),
+		{"started": str(now_datetime()), "accounts": len(entries)},
+		expires_in_sec=SYNC_RUN_TTL,
+	)
+	cache.set_value(LATEST_RUN_KEY, run)
+	for entry in entries:
+		cache.rpush(PENDING_SYNCS_KEY, entry)
+
+	dispatch_account_syncs()
+
+
+def dispatch_account_syncs() -> None:
+	"""
+	Enqueue a job for the next pending account of each free slot.
+
+	Called when a run starts, when a job is done and by `retry_deferred_syncs`, which
+	also fills the slots of killed jobs once their keys have expired.
+	"""
+	cache = frappe.cache()
+	for slot in range(max(1, get_admin_config().sync_concurrency)):
+		slot_key = cache.make_key(f"banking_sync_slot|{slot}")
+		if not cache.set(slot_key, 1, ex=SYNC_LOCK_TIMEOUT, nx=True):
+			continue  # taken
+
+		entry = pop_pending_sync()
+		if not entry:
+			cache.delete(slot_key)
+			return
+
+		run, account, consent = entry
+		frappe.enqueue(
+			"banking.klarna_kosma_integration.scheduled_sync.sync_account",
+			queue=get_admin_config().sync_queue,
+			timeout=SYNC_LOCK_TIMEOUT,
+			run=run,
+			account=account,
+			consent=consent,
+			slot=slot,
+		)
+
+
+def pop_pending_sync() -> Optional[List[str]]:
+	"""
+	Take the next pending account whose consent is not being synced and claim its consent.
+	Accounts of busy consents go to the back of the queue.
+	"""
+	cache = frappe.cache()
+	for _ in range(cache.llen(PENDING_SYNCS_KEY)):
+		entry = cache.lpop(PENDING_SYNCS_KEY)
+		if entry is None:
+			return None
+
+		run, account, consent = json.loads(entry)
+		if cache.set(get_consent_key(consent), 1, ex=SYNC_LOCK_TIMEOUT, nx=True):
+			return [run, account, consent]
+
+		cache.rpush(PENDING_SYNCS_KEY, entry)
+
+	return None
+
+
+def sync_account(run: str, account: str, consent: str, slot: int) -> None:
+	"""Sync the transactions of one account of a run, then free its slot for the next one."""
+	try:
+		with sync_lock(account) as acquired:
+			if not acquired:
+				result = {"status": "Skipped"}  # already being synced by another job
+			else:
+				Admin().consent_transactions(account, account_last_sync_date(account))
+				result = {"status": "Success"}
+	except AdminUnavailableError:
+		# Retried within this run by `retry_deferred_syncs`
+		frappe.cache().sadd(DEFERRED_RUN_SYNCS_KEY, json.dumps([run, account, consent]))
+		result = {"status": "Deferred"}
+	except Exception as e:
+		frappe.db.rollback()
+		result = {"status": "Failed", "error": str(e)}
+	finally:
+		cache = frappe.cache()
+		cache.delete(get_consent_key(consent))
+		cache.delete(cache.make_key(f"banking_sync_slot|{slot}"))
+
+	result["finished"] = str(now_datetime())
+	record_result(run, account, result)
+	dispatch_account_syncs()
+
+
+def retry_deferred_syncs() -> None:
+	"""
+	Enqueue the syncs that were deferred while the Admin app was down. Accounts of a run
+	are retried within that run. Called via hooks. If the Admin app is still down, they
+	fail fast and are deferred again.
+	"""
+	if not frappe.db.get_single_value("Banking Settings", "enabled"):
+		return
+
+	cache = frappe.cache()
+	for key in (DEFERRED_SYNCS_KEY, DEFERRED_RUN_SYNCS_KEY):
+		members = list(cache.smembers(key))
+		if members:
+			cache.srem(key, *members)
+
+		for member in members:
+			member = member.decode() if isinstance(member, bytes) else member
+			if key == DEFERRED_SYNCS_KEY:
+				enqueue_sync(member)
+			else:
+				cache.rpush(PENDING_SYNCS_KEY, member)
+
+	dispatch_account_syncs()
+
+
+def record_result(run: str, account: str, result: Dict) -> None:
+	"""
+	Add the result of an account to the run. The summary of the latest run is written
+	after every account, so that it shows the progress of the run even if one of its jobs
+	never finishes. A deferred account's retry replaces its result.
+	"""
+	cache = frappe.cache()
+	results_key = get_run_key(run) + "|results"
+	cache.hset(results_key, account, result)
+	cache.expire(cache.make_key(results_key), SYNC_RUN_TTL)
+
+	run_info = cache.get_value(get_run_key(run))
+	if not run_info or cache.get_value(LATEST_RUN_KEY) != run:
+		return
+
+	results = {
+		key.decode() if isinstance(key, bytes) else key: value
+		for key, value in cache.hgetall(results_key).items()
+	}
+	pending = max(0, run_info["accounts"] - len(results))
+	statuses = [result["status"] for result in results.values()]
+	summary = {
+		"started": run_info["started"],
+		"finished": None if pending else max(result["finished"] for result in results.values()),
+		"Pending": pending,
+		**{status: statuses.count(status) for status in ("Success", "Skipped", "Deferred", "Failed")},
+		"accounts": results,
+	}
+	frappe.db.set_single_value(
+		"Banking Settings", "last_sync_summary", json.dumps(summary, indent=1, sort_keys=True)
+	)
+	frappe.db.commit()
+
+
+def get_run_key(run: str) -> str:
+	return f"banking_sync_run|{run}"
+
+
+def get_consent_key(consent: str) -> str:
+	return frappe.cache().make_key(f"banking_sync_consent|{consent}")
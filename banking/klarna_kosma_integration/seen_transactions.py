@@ -0,0 +1,108 @@
+# Copyright (c) 2024, ALYF GmbH and contributors
+# For license information, please see license.txt
+from typing import Iterable, List, Optional
+
+import frappe
+from redis.exceptions import RedisError
+
+from banking.connectors.bloom_filter import BloomFilter
+
+SEEN_TRANSACTIONS_TTL = 30 * 24 * 60 * 60  # seconds, accounts that aren't synced expire
+MIN_CAPACITY = 10_000
+
+# Set the bits of new IDs, unless the filter was dropped in the meantime: a filter
+# created by SETBIT would be shorter than the one the positions were computed for.
+# KEYS: filter, count. ARGV: ttl, number of IDs, positions...
+ADD_SCRIPT = """
+if redis.call("EXISTS", KEYS[1]) == 0 then
+	return 0
+end
+for i = 3, #ARGV do
+	redis.call("SETBIT", KEYS[1], ARGV[i], 1)
+end
+redis.call("EXPIRE", KEYS[1], ARGV[1])
+local count = redis.call("INCRBY", KEYS[2], ARGV[2])
+redis.call("EXPIRE", KEYS[2], ARGV[1])
+return count
+"""
+
+
+class SeenTransactions:
+	"""
+	Bloom filter of the transaction IDs of a Bank Account, kept in the site cache.
+
+	Tells which IDs are definitely new, so that only the others need to be looked up in
+	the database. It is built from the database on first use and rebuilt, with more
+	room, once it is full. New IDs are set bit by bit, so concurrent syncs don't lose
+	each other's updates.
+	"""
+
+	def __init__(self, account: str) -> None:
+		self.account = account
+		self.redis = frappe.cache()
+		self.key = self.redis.make_key(f"banking_seen_transactions|{account}")
+		self.count_key = self.key + "|count"
+		self.bloom_filter = None
+		self.bits = b""
+
+	@classmethod
+	def load(cls, account: str) -> Optional["SeenTransactions"]:
+		"""Return the filter of `account` or `None` if the cache is not available."""
+		seen = cls(account)
+		try:
+			bits = seen.redis.get(seen.key) or seen.build()
+		except RedisError:
+			return None
+
+		seen.bits = bits
+		seen.bloom_filter = BloomFilter(len(bits) * 8)
+		return seen
+
+	def build(self) -> bytes:
+		transaction_ids = frappe.get_all(
+			"Bank Transaction",
+			filters={"bank_account": self.account, "transaction_id": ["is", "set"]},
+			pluck="transaction_id",
+		)
+		bloom_filter = BloomFilter.for_capacity(max(MIN_CAPACITY, 2 * len(transaction_ids)))
+
+		pipeline = self.redis.pipeline()
+		pipeline.set(
+			self.key, bloom_filter.to_bytes(transaction_ids), ex=SEEN_TRANSACTIONS_TTL, nx=True
+		)
+		pipeline.set(self.count_key, len(transaction_ids), ex=SEEN_TRANSACTIONS_TTL, nx=True)
+		pipeline.get(self.key)  # ours or that of a concurrent sync
+		return pipeline.execute()[-1]
+
+	def filter_maybe_seen(self, transaction_ids: Iterable[str]) -> List[str]:
+		"""Return the IDs that may have been seen. All others are definitely new."""
+		return [
+			transaction_id
+			for transaction_id in transaction_ids
+			if self.bloom_filter.might_contain(self.bits, transaction_id)
+		]
+
+	def add(self, transaction_ids: List[str]) -> None:
+		if not transaction_ids:
+			return
+
+		positions = [
+			position
+			for transaction_id in transaction_ids
+			for position in self.bloom_filter.positions(transaction_id)
+		]
+		try:
+			count = self.redis.eval(
+				ADD_SCRIPT,
+				2,
+				self.key,
+				self.count_key,
+				SEEN_TRANSACTIONS_TTL,
+				len(transaction_ids),
+				*positions,
+			)
+			if count > self.bloom_filter.capacity:
+				# Too many false positives from now on, rebuild a bigger one next time
+				self.redis.delete(self.key, self.count_key)
+		except RedisError:
+			pass
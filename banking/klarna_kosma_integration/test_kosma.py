@@ -1,4 +1,6 @@
 import json
+from unittest.mock import patch
+
 import frappe
 
 from frappe.client import get_count
@@ -6,6 +8,7 @@ from frappe.tests.utils import FrappeTestCase
 from frappe.utils import add_days, getdate, get_datetime, nowdate
 
 from banking.connectors.admin_transaction import AdminTransaction
+from banking.connectors.transaction_normalizer import normalize_transactions
 from banking.demo_responses.test_responses import (
 	accounts_response_1,
 	accounts_response_2,
@@ -20,9 +23,11 @@ from banking.klarna_kosma_integration.doctype.banking_settings.banking_settings
 from banking.klarna_kosma_integration.admin import Admin
 from banking.klarna_kosma_integration.utils import (
 	add_bank,
+	bulk_insert_bank_transactions,
 	create_bank_transactions,
 	create_session_doc,
 	get_account_name,
+	update_kosma_account_ids,
 )
 
 from erpnext.accounts.doctype.journal_entry.journal_entry import (
@@ -70,6 +75,24 @@ class TestKosma(FrappeTestCase):
 		self.assertEqual(admin.api_token, "xabsttcpQr5")
 		self.assertEqual(admin.customer_id, "ADCB8A")
 
+	def test_admin_config_cache(self):
+		"""Test if Admin objects are built without reading the settings again"""
+		Admin()
+		with patch("frappe.get_single") as get_single:
+			for _ in range(3):
+				self.assertEqual(Admin().request.customer_id, "ADCB8A")
+
+		get_single.assert_not_called()
+
+		# Saving the settings invalidates the cached config
+		doc = frappe.get_single("Banking Settings")
+		doc.customer_id = "FFEE01"
+		doc.save()
+		self.assertEqual(Admin().customer_id, "FFEE01")
+
+		doc.customer_id = "ADCB8A"
+		doc.save()
+
 	def test_kosma_session(self):
 		"""Test creation of Kosma session and updation via flow"""
 		session_data = session_response.session_data
@@ -153,6 +176,32 @@ class TestKosma(FrappeTestCase):
 		self.assertEqual(account_name, "DE06000000000023456789")
 		self.assertTrue(frappe.db.exists("Bank Account", f"{account_name} - {bank_name}"))
 
+	def test_kosma_account_ids_update(self):
+		"""Test if Bank Accounts are linked to the Kosma accounts with the same IBAN"""
+		create_session_doc(session_response.session_data, session_response.flow_data)
+
+		bank_name = add_bank(bank_data_response)
+		acc = create_account_for_bank_account("Savings Account")
+		test_account_dict = accounts_response_1.result["accounts"][2]
+		add_bank_account(
+			account_data=test_account_dict,
+			gl_account=acc,
+			company="Bolt Trades",
+			bank_name="Testbank",
+		)
+		account_name = f"{get_account_name(test_account_dict)} - {bank_name}"
+		frappe.db.set_value("Bank Account", account_name, "kosma_account_id", "outdated")
+
+		names = update_kosma_account_ids(
+			[test_account_dict, {"id": "unknown", "iban": "DE00000000000000000000"}]
+		)
+
+		self.assertEqual(names, [account_name])
+		self.assertEqual(
+			frappe.db.get_value("Bank Account", account_name, "kosma_account_id"),
+			test_account_dict.get("id"),
+		)
+
 	def test_transactions_creation(self):
 		"""Test if transactions response is parsed and mapped correctly"""
 		# Create Bank and accounts before inserting transaction
@@ -204,6 +253,62 @@ class TestKosma(FrappeTestCase):
 		# Test last sync date correctness
 		self.assertEqual(getdate(last_sync_date), actual_last_sync_date)
 
+		# Test that existing transactions are skipped
+		create_bank_transactions(
+			account=f"My checking account (Max Mustermann) - {bank_name}",
+			transactions=iter(transaction.transaction_list),
+		)
+		self.assertEqual(get_count("Bank Transaction"), 17)
+
+	def test_transactions_bulk_creation(self):
+		"""Test if transactions inserted in bulk match the regular ones"""
+		create_session_doc(session_response.session_data, session_response.flow_data)
+
+		bank_name = add_bank(bank_data_response)
+		acc = create_account_for_bank_account("Business Account")
+		add_bank_account(
+			account_data=accounts_response_1.result["accounts"][1],
+			gl_account=acc,
+			company="Bolt Trades",
+			bank_name="Testbank",
+		)
+		account = f"My checking account (Max Mustermann) - {bank_name}"
+
+		transactions = AdminTransaction(transactions_consent_response).transaction_list
+		transactions = [
+			dict(row, transaction_id=f"bulk-{row['transaction_id']}")
+			if row.get("transaction_id")
+			else row
+			for row in transactions
+		]
+		count = get_count("Bank Transaction")
+
+		frappe.db.set_single_value("Banking Settings", "bulk_insert_transactions", 1)
+		try:
+			create_bank_transactions(account=account, transactions=iter(transactions))
+			create_bank_transactions(account=account, transactions=iter(transactions))
+		finally:
+			frappe.db.set_single_value("Banking Settings", "bulk_insert_transactions", 0)
+
+		self.assertEqual(get_count("Bank Transaction"), count + 17)
+
+		# Rows inserted meanwhile by a concurrent sync are skipped and not reported as created
+		rows = [row for row in normalize_transactions(transactions) if row.transaction_id]
+		self.assertEqual(bulk_insert_bank_transactions(account, rows, set()), [])
+		self.assertEqual(get_count("Bank Transaction"), count + 17)
+
+		doc = frappe.get_doc(
+			"Bank Transaction", {"transaction_id": transactions[0]["transaction_id"]}
+		)
+		self.assertEqual(doc.docstatus, 1)
+		self.assertEqual(doc.company, "Bolt Trades")
+		self.assertEqual(doc.withdrawal, 3242.29)
+		self.assertEqual(doc.unallocated_amount, 3242.29)
+		self.assertEqual(doc.status, "Settled")
+		self.assertEqual(doc.date, getdate("2022-12-03"))
+
+		frappe.db.delete("Bank Transaction", {"transaction_id": ["like", "bulk-%"]})
+
 	def test_bank_consent_set_get(self):
 		from banking.klarna_kosma_integration.utils import (
 			get_consent_data,
@@ -1,25 +1,48 @@
 # Copyright (c) 2022, ALYF GmbH and contributors
 # For license information, please see license.txt
+import ipaddress
 import json
-from typing import TYPE_CHECKING, Dict, List, Optional
+from itertools import islice
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Set
+from banking.connectors.json_codec import loads
+from banking.connectors.transaction_normalizer import (
+	TransactionRow,
+	Watermark,
+	normalize_transaction,
+	normalize_transactions,
+)
+from banking.klarna_kosma_integration.admin_config import get_admin_config
 from banking.klarna_kosma_integration.exception_handler import ExceptionHandler
+from banking.klarna_kosma_integration.seen_transactions import SeenTransactions
 
 import frappe
 import requests
 from frappe import _
+from frappe.query_builder import Case
 from frappe.utils import (
 	add_days,
 	add_to_date,
+	flt,
 	formatdate,
 	get_datetime,
 	get_first_day,
 	getdate,
+	now,
 	nowdate,
 )
 
 if TYPE_CHECKING:
 	from frappe.model.document import Document
 
+# Transactions per duplicate lookup. Small enough to keep the IN list cheap and to
+# start inserting a streamed page before it is complete.
+TRANSACTION_BATCH_SIZE = 500
+TRANSACTION_SAVEPOINT = "bank_transaction_insert"
+
+LOOPBACK_ADDRESSES = ("127.0.0.1", "::1")
+PUBLIC_IP_CACHE_KEY = "banking_public_ip"
+PUBLIC_IP_CACHE_TTL = 60 * 60  # seconds
+
 # Ref: https://docs.openbanking.klarna.com/countries.html
 # Some countries are modified to match the country names in ERPNext (eg. GB -> UK)
 SUPPORTED_COUNTRIES = [
@@ -207,6 +230,68 @@ def update_bank_account(account_data: dict, bank_account_name: str) -> None:
 		)
 
 
+def update_kosma_account_ids(accounts: List[Dict]) -> List[str]:
+	"""
+	Link the Bank Accounts with the IBANs of the Kosma `accounts` to them. Return the
+	names of the Bank Accounts found.
+
+	All IBANs are resolved in one query and only the links that changed are updated, in
+	one statement.
+	"""
+	ibans = [account.get("iban") for account in accounts if account.get("iban")]
+	if not ibans:
+		return []
+
+	bank_accounts = {}
+	for name, iban, kosma_account_id in frappe.get_all(
+		"Bank Account",
+		filters={"iban": ["in", ibans]},
+		fields=["name", "iban", "kosma_account_id"],
+		order_by="creation",
+		as_list=True,
+	):
+		bank_accounts.setdefault(iban, (name, kosma_account_id))
+
+	names, changes = [], {}
+	for account in accounts:
+		if account.get("iban") not in bank_accounts:
+			continue
+
+		name, kosma_account_id = bank_accounts[account["iban"]]
+		names.append(name)
+		if kosma_account_id != account.get("id"):
+			changes[name] = account.get("id")
+
+	if not changes:
+		return names
+
+	try:
+		bank_account = frappe.qb.DocType("Bank Account")
+		kosma_account_id = Case()
+		for name, account_id in changes.items():
+			kosma_account_id = kosma_account_id.when(bank_account.name == name, account_id)
+
+		(
+			frappe.qb.update(bank_account)
+			.set(bank_account.kosma_account_id, kosma_account_id)
+			.set(bank_account.modified, now())
+			.set(bank_account.modified_by, frappe.session.user)
+			.where(bank_account.name.isin(list(changes)))
+		).run()
+	except Exception:
+		frappe.log_error(
+			title=_("Kosma Error - Bank Account Update"), message=frappe.get_traceback()
+		)
+		frappe.throw(
+			_("There was an error updating Bank Accounts {} while linking with Kosma.").format(
+				", ".join(changes)
+			),
+			title=_("Kosma Link Error"),
+		)
+
+	return names
+
+
 def get_account_name(account: Dict) -> str:
 	"""
 	Generates and returns distinguishable account name.
@@ -230,79 +315,270 @@ def get_account_name(account: Dict) -> str:
 
 
 def create_bank_transactions(
-	account: str, transactions: List[Dict], via_flow_api: bool = False
-) -> None:
+	account: str,
+	transactions: Iterable[Dict],
+	via_flow_api: bool = False,
+	watermark: Optional[Watermark] = None,
+) -> Optional[str]:
+	"""
+	Insert new Bank Transactions. `transactions` may be a stream, it is only iterated once.
+
+	As streamed pages are not ordered oldest first, the last integration date is only set
+	once the whole page has been inserted. Return it.
+
+	Transactions known to the `watermark` are skipped right away, it is then advanced
+	past the page.
+	"""
 	last_sync_date = None
+	bulk_insert = use_bulk_insert()
+	seen = SeenTransactions.load(account)
 	try:
-		for transaction in reversed(transactions):
-			transaction_created = new_bank_transaction(account, transaction)
-
-			if not transaction_created or via_flow_api:
+		for batch in batched(normalize_transactions(transactions), TRANSACTION_BATCH_SIZE):
+			if watermark:
+				known = [row for row in batch if watermark.is_known(row)]
+				batch = [row for row in batch if not watermark.is_known(row)]
+				watermark.advance(known)
+
+			existing_ids = get_existing_transaction_ids(account, batch, seen)
+			if bulk_insert:
+				created = bulk_insert_bank_transactions(account, batch, existing_ids)
+			else:
+				created = [
+					row for row in batch if insert_bank_transaction(account, row, existing_ids)
+				]
+
+			if seen:
+				seen.add([row.transaction_id for row in created if row.transaction_id])
+
+			if watermark:
+				watermark.advance(batch)
+
+			if via_flow_api:
 				# Don't set last integration date if via Flow API (one time action with arbitrary time period)
-				# or if transaction was not inserted
 				continue
 
-			last_sync_date = transaction.get("value_date") or transaction.get("date")
+			for row in created:
+				last_sync_date = max(last_sync_date or row.date, row.date)
 
 	except Exception:
 		frappe.log_error(title=_("Kosma Transaction Error"), message=frappe.get_traceback())
 		frappe.throw(_("Error creating transactions"))
-	finally:
-		if last_sync_date:
-			frappe.db.set_value("Bank Account", account, "last_integration_date", last_sync_date)
-
-
-def new_bank_transaction(account: str, transaction: Dict) -> bool:
-	amount_data = transaction.get("amount", {})
-	amount = (
-		amount_data.get("amount", 0) / 100
-	)  # https://docs.openbanking.klarna.com/xs2a/objects/amount.html
-
-	is_credit = transaction.get("type") == "CREDIT"
-	debit = 0 if is_credit else float(amount)
-	credit = float(amount) if is_credit else 0
-
-	state_map = {
-		"PROCESSED": "Settled",
-		"PENDING": "Pending",
-		"CANCELED": "Settled",  # TODO: is this status ok ? Should we even consider making cancelled/failed records
-		"FAILED": "Settled",
+
+	if last_sync_date:
+		frappe.db.set_value("Bank Account", account, "last_integration_date", last_sync_date)
+
+	return last_sync_date
+
+
+def batched(iterable: Iterable, size: int) -> Iterator[List]:
+	"""Yield lists of up to `size` items, consuming `iterable` lazily."""
+	iterator = iter(iterable)
+	while True:
+		batch = list(islice(iterator, size))
+		if not batch:
+			return
+
+		yield batch
+
+
+def get_existing_transaction_ids(
+	account: str, rows: List[TransactionRow], seen: Optional[SeenTransactions] = None
+) -> Set[str]:
+	"""
+	Return the IDs of `rows` that exist for `account`, in one query.
+
+	IDs that are not in `seen` are new for sure and are not looked up.
+	"""
+	transaction_ids = list({row.transaction_id for row in rows} - {None, ""})
+	if seen:
+		transaction_ids = seen.filter_maybe_seen(transaction_ids)
+
+	if not transaction_ids:
+		return set()
+
+	return set(
+		frappe.get_all(
+			"Bank Transaction",
+			filters={"bank_account": account, "transaction_id": ["in", transaction_ids]},
+			pluck="transaction_id",
+		)
+	)
+
+
+def is_existing_transaction(
+	account: str, transaction_id: str, existing_ids: Optional[Set[str]]
+) -> bool:
+	if existing_ids is not None and transaction_id:
+		return transaction_id in existing_ids
+
+	return bool(
+		frappe.db.exists(
+			"Bank Transaction", {"bank_account": account, "transaction_id": transaction_id}
+		)
+	)
+
+
+def get_bank_transaction_data(account: str, row: TransactionRow) -> Dict:
+	"""Map a normalized Kosma transaction to Bank Transaction values."""
+	return {
+		"doctype": "Bank Transaction",
+		"date": getdate(row.date),
+		"status": row.status.value,
+		"bank_account": account,
+		"deposit": row.deposit,
+		"withdrawal": row.withdrawal,
+		"currency": row.currency,
+		"transaction_id": row.transaction_id,
+		"reference_number": row.reference_number,
+		"description": row.description,
+		"bank_party_name": row.party_name,
+		"bank_party_iban": row.party_iban,
+		"bank_party_account_number": row.party_account_number,
 	}
-	status = state_map[transaction.get("state")]
-	transaction_id = transaction.get("transaction_id")
 
-	if not transaction_id and transaction.get("state") == "PENDING":
-		# Dont insert pending transactions. transaction_id is absent only for Pending state
-		# Ref: https://docs.openbanking.klarna.com/xs2a/objects/transaction.html
+
+def new_bank_transaction(
+	account: str, transaction: Dict, existing_ids: Optional[Set[str]] = None
+) -> bool:
+	"""Insert and submit a Kosma transaction, unless it is to be skipped or exists already."""
+	row = normalize_transaction(transaction)
+	return bool(row) and insert_bank_transaction(account, row, existing_ids)
+
+
+def insert_bank_transaction(
+	account: str, row: TransactionRow, existing_ids: Optional[Set[str]] = None
+) -> bool:
+	"""
+	Insert and submit a Bank Transaction, unless it exists already.
+
+	`existing_ids` are the known transaction IDs, as returned by `get_existing_transaction_ids`.
+	Inserted IDs are added to it. If it is not passed, the database is asked instead.
+	"""
+	if is_existing_transaction(account, row.transaction_id, existing_ids):
 		return False
 
-	if frappe.db.exists("Bank Transaction", {"transaction_id": transaction_id}):
+	new_transaction = frappe.get_doc(get_bank_transaction_data(account, row))
+	try:
+		frappe.db.savepoint(TRANSACTION_SAVEPOINT)
+		new_transaction.insert()
+	except frappe.UniqueValidationError:
+		# Inserted by a concurrent sync of the same account in the meantime
+		frappe.db.rollback(save_point=TRANSACTION_SAVEPOINT)
+		frappe.clear_last_message()
 		return False
 
-	new_transaction = frappe.get_doc(
-		{
-			"doctype": "Bank Transaction",
-			"date": getdate(transaction.get("value_date") or transaction.get("date")),
-			"status": status,
-			"bank_account": account,
-			"deposit": credit,
-			"withdrawal": debit,
-			"currency": amount_data.get("currency"),
-			"transaction_id": transaction_id,
-			"reference_number": transaction.get("bank_references", {}).get("end_to_end"),
-			"description": transaction.get("reference"),
-			"bank_party_name": transaction.get("counter_party", {}).get("holder_name"),
-			"bank_party_iban": transaction.get("counter_party", {}).get("iban"),
-			"bank_party_account_number": transaction.get("counter_party", {}).get(
-				"account_number"
-			),
-		}
-	)
-	new_transaction.insert()
 	new_transaction.submit()
+
+	if existing_ids is not None:
+		existing_ids.add(row.transaction_id)
+
 	return True
 
 
+def use_bulk_insert() -> bool:
+	"""
+	Whether Bank Transactions are inserted in bulk.
+
+	Not while party matching is enabled, as it runs when a Bank Transaction is submitted.
+	"""
+	return bool(
+		frappe.db.get_single_value("Banking Settings", "bulk_insert_transactions")
+		and not frappe.db.get_single_value("Accounts Settings", "enable_party_matching")
+	)
+
+
+def bulk_insert_bank_transactions(
+	account: str, rows: List[TransactionRow], existing_ids: Set[str]
+) -> List[TransactionRow]:
+	"""
+	Insert `rows` as submitted Bank Transactions with one query and return the
+	inserted ones.
+
+	Skips the document lifecycle (hooks, version and label comments). Instead, the links
+	and the status are validated once for the whole batch and the values that ERPNext
+	sets on insert (company, unallocated amount) are set here.
+	"""
+	company = frappe.db.get_value("Bank Account", account, "company")
+	if not company:
+		frappe.throw(_("Bank Account {0} not found").format(account), frappe.LinkValidationError)
+
+	docs, new_rows = [], []
+	for row in rows:
+		if is_existing_transaction(account, row.transaction_id, existing_ids):
+			continue
+
+		doc = frappe.new_doc("Bank Transaction")
+		doc.update(get_bank_transaction_data(account, row))
+		doc.company = company
+		doc.docstatus = 1
+		doc.allocated_amount = 0
+		doc.unallocated_amount = abs(flt(doc.withdrawal) - flt(doc.deposit))
+		docs.append(doc)
+		new_rows.append(row)
+		existing_ids.add(row.transaction_id)
+
+	if not docs:
+		return []
+
+	validate_currencies({doc.currency for doc in docs})
+	validate_statuses({doc.status for doc in docs})
+
+	for doc in docs:
+		doc.set_new_name()
+		doc.set_user_and_timestamp()
+
+	values = [doc.get_valid_dict(convert_dates_to_str=True, ignore_nulls=True) for doc in docs]
+	fields = list({fieldname: None for value in values for fieldname in value})
+	# Rows inserted by a concurrent sync of the same account are skipped by the unique index
+	insert_skipping_duplicates(
+		"Bank Transaction",
+		fields,
+		[[value.get(fieldname) for fieldname in fields] for value in values],
+	)
+
+	inserted = set(
+		frappe.get_all(
+			"Bank Transaction",
+			filters={"name": ["in", [doc.name for doc in docs]], "bank_account": account},
+			pluck="name",
+		)
+	)
+	return [row for doc, row in zip(docs, new_rows) if doc.name in inserted]
+
+
+def insert_skipping_duplicates(doctype: str, fields: List[str], values: List[List]) -> None:
+	"""
+	Insert `values` with one query, skipping rows that violate a unique key. Unlike
+	`INSERT IGNORE`, any other error (e.g. an invalid or truncated value) is raised.
+	"""
+	table = frappe.qb.DocType(doctype)
+	query = frappe.qb.into(table).columns(*fields).insert(*values)
+	if frappe.db.db_type == "postgres":
+		query = query.on_conflict().do_nothing()
+	else:
+		query = query.on_duplicate_key_update(table.name, table.name)
+
+	query.run()
+
+
+def validate_statuses(statuses: Set[str]) -> None:
+	options = frappe.get_meta("Bank Transaction").get_options("status").split("\n")
+	for status in statuses - set(options):
+		frappe.throw(_("Invalid status {0} for Bank Transaction").format(status))
+
+
+def validate_currencies(currencies: Set[str]) -> None:
+	currencies = currencies - {None, ""}
+	if not currencies:
+		return
+
+	found = set(
+		frappe.get_all("Currency", filters={"name": ["in", list(currencies)]}, pluck="name")
+	)
+	for currency in currencies - found:
+		frappe.throw(_("Currency {0} not found").format(currency), frappe.LinkValidationError)
+
+
 def get_from_to_date(from_date: Optional[str] = None, to_date: Optional[str] = None):
 	"""
 	Get from and to date for session and consent creation.
@@ -320,11 +596,18 @@ def to_json(response: requests.models.Response) -> Dict:
 	Check if response is in JSON format. If not, return {}
 	"""
 	is_json = "application/json" in response.headers.get("Content-Type", "")
-	return response.json() if is_json else {}
+	return loads(response.content) if is_json else {}
 
 
 def account_last_sync_date(account_name: str):
-	"""Get Account's Last Integration Date or Consent Start Date."""
+	"""
+	Get the date to sync an Account's transactions from: the booking date up to which
+	they were synced, else the Last Integration Date or the Consent Start Date.
+	"""
+	watermark = frappe.db.get_value("Bank Account Sync State", account_name, "watermark")
+	if watermark:
+		return formatdate(watermark, "YYYY-MM-dd")
+
 	last_sync_date, bank, company = frappe.db.get_value(
 		"Bank Account", account_name, ["last_integration_date", "bank", "company"]
 	)
@@ -352,18 +635,61 @@ def get_current_ip() -> Optional[str]:
 	"""Return the current IP or `None`.
 
 	- If run outside of a request context, return `None` (e.g. in a background job).
-	- If run on localhost, return the public IP address as queried from AWS checkip.
+	- If run on localhost (e.g. behind a reverse proxy that doesn't set `X-Forwarded-For`),
+	  return the first of: the IP configured in Banking Settings, the client IP forwarded
+	  by the proxy or the public IP address as queried from AWS checkip.
 	"""
 	if not frappe.request:
 		return None
 
 	ip_address = frappe.local.request_ip
-	if ip_address == "127.0.0.1":
+	if ip_address not in LOOPBACK_ADDRESSES:
+		return ip_address
+
+	return get_admin_config().public_ip_address or get_forwarded_ip() or get_public_ip()
+
+
+def get_forwarded_ip() -> Optional[str]:
+	"""
+	Return the client IP from the `X-Real-IP` or `Forwarded` header.
+
+	Only called for requests that reached us via localhost, i.e. from a trusted proxy.
+	"""
+	candidates = [frappe.get_request_header("X-Real-IP")]
+
+	forwarded = frappe.get_request_header("Forwarded") or ""
+	for directive in forwarded.split(",")[0].split(";"):
+		name, _, value = directive.strip().partition("=")
+		if name.lower() == "for":
+			# e.g. for=192.0.2.60 or for="[2001:db8::17]:4711"
+			value = value.strip('"')
+			value = value[1:].split("]")[0] if value.startswith("[") else value.split(":")[0]
+			candidates.append(value)
+
+	for candidate in candidates:
 		try:
-			ip_address = requests.get("https://checkip.amazonaws.com", timeout=3).text.strip()
-		except Exception as exc:
-			ExceptionHandler(exc)
+			ip_address = ipaddress.ip_address((candidate or "").strip())
+		except ValueError:
+			continue
 
+		if not ip_address.is_loopback:
+			return str(ip_address)
+
+
+def get_public_ip() -> Optional[str]:
+	"""Return the public IP of this server, looked up at most once per hour and site."""
+	ip_address = frappe.cache().get_value(PUBLIC_IP_CACHE_KEY)
+	if ip_address:
+		return ip_address
+
+	try:
+		ip_address = requests.get("https://checkip.amazonaws.com", timeout=3).text.strip()
+	except Exception as exc:
+		ExceptionHandler(exc)
+
+	frappe.cache().set_value(
+		PUBLIC_IP_CACHE_KEY, ip_address, expires_in_sec=PUBLIC_IP_CACHE_TTL
+	)
 	return ip_address
 
 
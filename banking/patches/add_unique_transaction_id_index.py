@@ -0,0 +1,118 @@
+import frappe
+from frappe import _
+
+UNIQUE_INDEX = "unique_transaction_id"
+UNIQUE_KEY_COLUMN = "_unique_transaction_id"
+LOOKUP_INDEX = "bank_account_transaction_id_index"
+
+
+def execute():
+	"""
+	Make (bank_account, transaction_id) unique for Bank Transactions that are not cancelled.
+
+	Cancelled transactions are left out, so that they can still be amended. Transactions
+	without an ID are left out, as they are created manually.
+
+	Existing duplicates are cancelled first, unless they are reconciled: then the migration
+	fails, until they are cleaned up by hand.
+	"""
+	frappe.db.add_index("Bank Transaction", ["bank_account", "transaction_id"], LOOKUP_INDEX)
+
+	remove_duplicates()
+
+	if frappe.db.db_type == "postgres":
+		frappe.db.sql(
+			f"""
+			CREATE UNIQUE INDEX IF NOT EXISTS "{UNIQUE_INDEX}"
+			ON "tabBank Transaction" (bank_account, transaction_id)
+			WHERE docstatus < 2 AND transaction_id <> ''
+			"""
+		)
+		return
+
+	# MariaDB has no partial indexes: index a virtual column that is NULL for the
+	# rows to leave out, NULLs don't collide
+	if not frappe.db.has_column("Bank Transaction", UNIQUE_KEY_COLUMN):
+		frappe.db.sql_ddl(
+			f"""
+			ALTER TABLE `tabBank Transaction`
+			ADD COLUMN `{UNIQUE_KEY_COLUMN}` VARCHAR(140)
+				AS (IF(docstatus < 2 AND transaction_id <> '', transaction_id, NULL)) VIRTUAL,
+			ADD UNIQUE INDEX `{UNIQUE_INDEX}` (bank_account, `{UNIQUE_KEY_COLUMN}`)
+			"""
+		)
+
+
+def remove_duplicates():
+	"""
+	Keep one Bank Transaction per (bank_account, transaction_id): the one with allocations,
+	else the oldest submitted one. The others have nothing allocated: submitted ones are
+	cancelled, drafts are deleted (and kept as Deleted Documents). All of them are listed
+	in the Error Log.
+	"""
+	duplicates = frappe.db.sql(
+		"""
+		SELECT bank_account, transaction_id
+		FROM `tabBank Transaction`
+		WHERE docstatus < 2 AND transaction_id <> ''
+		GROUP BY bank_account, transaction_id
+		HAVING COUNT(*) > 1
+		"""
+	)
+
+	to_remove, conflicts = {}, []
+	for bank_account, transaction_id in duplicates:
+		transactions = frappe.get_all(
+			"Bank Transaction",
+			filters={
+				"bank_account": bank_account,
+				"transaction_id": transaction_id,
+				"docstatus": ["<", 2],
+			},
+			pluck="name",
+			order_by="docstatus desc, creation asc",
+		)
+		allocated = set(
+			frappe.get_all(
+				"Bank Transaction Payments",
+				filters={"parent": ["in", transactions], "parenttype": "Bank Transaction"},
+				pluck="parent",
+			)
+		)
+		if len(allocated) > 1:
+			conflicts.append((bank_account, transaction_id))
+			continue
+
+		keep = next((name for name in transactions if name in allocated), transactions[0])
+		to_remove.update((name, keep) for name in transactions if name != keep)
+
+	if conflicts:
+		frappe.throw(
+			_(
+				"Bank Transaction IDs are not unique and more than one of the duplicates is"
+				" reconciled. Please unreconcile and cancel the duplicates, then run the"
+				" migration again: {0}"
+			).format(conflicts[:10]),
+			title=_("Duplicate Bank Transactions"),
+		)
+
+	if not to_remove:
+		return
+
+	docs = {name: frappe.get_doc("Bank Transaction", name) for name in to_remove}
+	frappe.log_error(
+		title=_("Duplicate Bank Transactions removed"),
+		message=frappe.as_json(
+			[
+				{**doc.as_dict(no_default_fields=True), "name": name, "duplicate_of": to_remove[name]}
+				for name, doc in docs.items()
+			]
+		),
+	)
+
+	for name, doc in docs.items():
+		doc.flags.ignore_permissions = True
+		if doc.docstatus == 1:
+			doc.cancel()
+		else:
+			frappe.delete_doc("Bank Transaction", name, ignore_permissions=True)
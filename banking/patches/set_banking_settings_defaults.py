@@ -0,0 +1,12 @@
+import frappe
+
+
+def execute():
+	"""Set the defaults of Banking Settings fields that were added after the settings were saved."""
+	values = frappe.db.get_singles_dict("Banking Settings")
+	if not values:
+		return  # never saved, defaults are applied when the settings are loaded
+
+	for df in frappe.get_meta("Banking Settings").fields:
+		if df.default is not None and values.get(df.fieldname) is None:
+			frappe.db.set_single_value("Banking Settings", df.fieldname, df.default)
@@ -0,0 +1,74 @@
+"""
+Compare the per-page latency of a paginated consent sync with and without the pooled session.
+
+Usage: python benchmarks/connection_pool.py [--pages 200]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from banking.connectors.admin_request import AdminRequest  # noqa: E402
+from stub_admin_server import base_url, start_stub_server  # noqa: E402
+
+
+def get_request(url: str) -> AdminRequest:
+	return AdminRequest(
+		ip_address=None,
+		user_agent=None,
+		api_token="token",
+		url=url,
+		customer_id="customer",
+		use_test_environment=False,
+	)
+
+
+def sync_with_new_connections(request: AdminRequest, pages: int) -> list:
+	"""Previous behaviour: module level `requests.post`, one TCP connection per page."""
+	timings = []
+	for offset in range(pages):
+		data = request.data
+		data.update({"account_id": "acc", "offset": str(offset)})
+		start = time.perf_counter()
+		requests.post(
+			url=request.url + "banking_admin.api.fetch_consent_transactions",
+			headers=request.headers,
+			data=json.dumps(data),
+		).json()
+		timings.append(time.perf_counter() - start)
+	return timings
+
+
+def sync_with_pooled_session(request: AdminRequest, pages: int) -> list:
+	timings = []
+	for offset in range(pages):
+		start = time.perf_counter()
+		request.consent_transactions("acc", "2024-01-01", "consent", "token", None, str(offset)).json()
+		timings.append(time.perf_counter() - start)
+	return timings
+
+
+def report(label: str, timings: list) -> None:
+	print(
+		f"{label:<20} median {statistics.median(timings) * 1000:7.3f} ms/page, "
+		f"total {sum(timings) * 1000:9.1f} ms"
+	)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--pages", type=int, default=200)
+	args = parser.parse_args()
+
+	server = start_stub_server(pages=args.pages)
+	request = get_request(base_url(server))
+
+	report("new connection", sync_with_new_connections(request, args.pages))
+	report("pooled session", sync_with_pooled_session(request, args.pages))
+	server.shutdown()
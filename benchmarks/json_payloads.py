@@ -0,0 +1,120 @@
+"""
+Measure bytes on the wire and the time to download and decode a streamed transaction
+page, using the `demo_responses` fixture scaled to large pages.
+
+Each page is served gzip-encoded from memory through `requests`, the way the Admin app
+sends it, and read by `AdminTransactionStream` (or, without Frappe, by `StreamDecoder`
+in the same loop). Items are decoded one by one (`raw_decode`), in batches with the
+standard library, and in batches with the fast codec.
+
+Usage: python benchmarks/json_payloads.py [--sizes 100 1000 5000]
+"""
+import argparse
+import codecs
+import gzip
+import io
+import json
+import os
+import sys
+import timeit
+from unittest.mock import patch
+
+import requests
+from urllib3 import HTTPResponse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from banking.connectors import json_codec  # noqa: E402
+from banking.connectors.stream_decoder import StreamDecoder  # noqa: E402
+
+try:
+	from banking.connectors.admin_transaction import STREAM_CHUNK_SIZE, AdminTransactionStream
+except ImportError:  # Frappe is not installed
+	AdminTransactionStream = None
+	STREAM_CHUNK_SIZE = 64 * 1024
+
+FIXTURE = os.path.join(
+	os.path.dirname(__file__),
+	"..",
+	"banking",
+	"demo_responses",
+	"transactions",
+	"trans-psd2-de-embedded-consent.json",
+)
+
+
+def make_page(transactions: list, size: int) -> bytes:
+	page = []
+	for i in range(size):
+		transaction = dict(transactions[i % len(transactions)])
+		transaction["transaction_id"] = f"{i:032x}"
+		page.append(transaction)
+
+	response = {"message": {"result": {"transactions": page, "pagination": {}}}}
+	return json.dumps(response).encode()
+
+
+def make_response(body: bytes) -> requests.Response:
+	response = requests.Response()
+	response.status_code = 200
+	response.headers["Content-Type"] = "application/json"
+	response.headers["Content-Encoding"] = "gzip"
+	response.raw = HTTPResponse(
+		body=io.BytesIO(body),
+		headers=dict(response.headers),
+		status=200,
+		preload_content=False,
+		decode_content=True,
+	)
+	return response
+
+
+def read_page(body: bytes) -> int:
+	response = make_response(body)
+	if AdminTransactionStream:
+		return sum(1 for _ in AdminTransactionStream(response))
+
+	decoder = StreamDecoder()
+	text_decoder = codecs.getincrementaldecoder("utf-8")()
+	count = 0
+	for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+		count += sum(1 for _ in decoder.feed(text_decoder.decode(chunk)))
+
+	decoder.close()
+	return count
+
+
+def best_of(func, number: int = 5) -> float:
+	return min(timeit.repeat(func, number=1, repeat=number)) * 1000
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000])
+	args = parser.parse_args()
+
+	with open(FIXTURE) as f:
+		transactions = json.load(f)["data"]["result"]["transactions"]
+
+	print(f"orjson available: {bool(json_codec.orjson)}")
+	print(f"reader: {'AdminTransactionStream' if AdminTransactionStream else 'StreamDecoder'}\n")
+	print(
+		f"{'page size':>9} {'identity':>10} {'gzip':>9}"
+		f" {'raw_decode':>11} {'batch json':>11} {'batch codec':>12}"
+	)
+
+	for size in args.sizes:
+		body = make_page(transactions, size)
+		gzipped = gzip.compress(body)
+		assert read_page(gzipped) == size
+
+		with patch("banking.connectors.stream_decoder.decode_batch", lambda text, pos: (None, pos)):
+			per_item = best_of(lambda: read_page(gzipped))
+		with patch("banking.connectors.stream_decoder.loads", json.loads):
+			stdlib = best_of(lambda: read_page(gzipped))
+		codec = best_of(lambda: read_page(gzipped))
+
+		print(
+			f"{size:>9} {len(body) / 1024:>8.0f}KB {len(gzipped) / 1024:>7.0f}KB"
+			f" {per_item:>9.2f}ms {stdlib:>9.2f}ms {codec:>10.2f}ms"
+		)
@@ -0,0 +1,53 @@
+"""
+Measure the cost of turning Kosma transactions into Bank Transaction rows, without
+any database access.
+
+The demo response is repeated to the requested number of transactions.
+
+Usage: python benchmarks/normalize_transactions.py [--transactions 100000]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from banking.connectors.transaction_normalizer import normalize_transactions  # noqa: E402
+
+FIXTURE = os.path.join(
+	os.path.dirname(__file__),
+	"..",
+	"banking",
+	"demo_responses",
+	"transactions",
+	"trans-psd2-de-embedded-consent.json",
+)
+
+
+def main(count: int, rounds: int = 5) -> None:
+	with open(FIXTURE) as f:
+		sample = json.load(f)["data"]["result"]["transactions"]
+
+	transactions = [
+		dict(sample[i % len(sample)], transaction_id=f"{i:032x}") for i in range(count)
+	]
+
+	timings = []
+	for _ in range(rounds):
+		start = time.perf_counter()
+		rows = list(normalize_transactions(transactions))
+		timings.append(time.perf_counter() - start)
+
+	best = min(timings)
+	print(
+		f"{len(rows)} rows in {best * 1000:.1f} ms "
+		f"({best / len(rows) * 1e6:.2f} µs per transaction, best of {rounds})"
+	)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--transactions", type=int, default=100_000)
+	main(parser.parse_args().transactions)
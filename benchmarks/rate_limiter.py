@@ -0,0 +1,81 @@
+"""
+Measure the request rate that reaches the Admin app when many workers sync at once.
+
+Each thread stands in for an RQ worker that pages through a consent sync against the
+local stub. With a limit, the stub should see about `--rate` requests per second after
+the initial burst, without the workers being serialized.
+
+Usage: python benchmarks/rate_limiter.py [--workers 8] [--pages 20] [--rate 20]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from banking.connectors.admin_request import AdminRequest  # noqa: E402
+from banking.connectors.rate_limiter import RateLimiter  # noqa: E402
+from stub_admin_server import StubAdminHandler, base_url, start_stub_server  # noqa: E402
+
+arrivals = []
+arrivals_lock = threading.Lock()
+
+
+class CountingHandler(StubAdminHandler):
+	def do_POST(self):
+		with arrivals_lock:
+			arrivals.append(time.perf_counter())
+		super().do_POST()
+
+
+def worker(url: str, pages: int, rate: float) -> None:
+	request = AdminRequest(
+		ip_address=None,
+		user_agent=None,
+		api_token="token",
+		url=url,
+		customer_id="customer",
+		use_test_environment=False,
+		# no Redis here: all threads share the in-process fallback bucket
+		rate_limiter=RateLimiter(rate, "customer") if rate else None,
+	)
+	offset = None
+	for _ in range(pages):
+		response = request.consent_transactions("acc", "2024-01-01", "id", "token", None, offset)
+		offset = response.json()["message"]["result"]["pagination"].get("next", {}).get("offset")
+
+
+def run(workers: int, pages: int, rate: float) -> None:
+	arrivals.clear()
+	server = start_stub_server(page_size=10, pages=pages, handler=CountingHandler)
+	threads = [
+		threading.Thread(target=worker, args=(base_url(server), pages, rate))
+		for _ in range(workers)
+	]
+	start = time.perf_counter()
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	server.shutdown()
+
+	duration = time.perf_counter() - start
+	first_second = sum(1 for t in arrivals if t - start < 1)
+	label = f"limit {rate:g}/s" if rate else "no limit"
+	print(
+		f"{label:>14}: {len(arrivals)} requests in {duration:.2f}s "
+		f"({len(arrivals) / duration:.1f}/s, {first_second} in the first second)"
+	)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--workers", type=int, default=8)
+	parser.add_argument("--pages", type=int, default=20)
+	parser.add_argument("--rate", type=float, default=20)
+	args = parser.parse_args()
+
+	run(args.workers, args.pages, 0)
+	run(args.workers, args.pages, args.rate)
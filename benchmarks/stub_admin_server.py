@@ -0,0 +1,67 @@
+"""
+A minimal stand-in for the Banking Admin app, used by the benchmarks in this folder.
+
+It answers every `POST /api/method/<method>` with a JSON page of fake transactions
+and keeps connections alive (HTTP/1.1), like the real app behind a reverse proxy.
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+
+def make_page(size: int, offset: int, pages: int) -> Dict:
+	transactions = [
+		{
+			"transaction_id": f"{offset:06d}{i:06d}",
+			"reference": f"Invoice {offset}-{i}",
+			"date": "2024-01-01",
+			"value_date": "2024-01-02",
+			"state": "PROCESSED",
+			"type": "DEBIT" if i % 2 else "CREDIT",
+			"amount": {"amount": 1000 + i, "currency": "EUR"},
+		}
+		for i in range(size)
+	]
+	next_offset = offset + 1
+	pagination = {"url": "stub", "next": {"offset": str(next_offset)}} if next_offset < pages else {}
+	return {"message": {"result": {"transactions": transactions, "pagination": pagination}}}
+
+
+class StubAdminHandler(BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1"
+	disable_nagle_algorithm = True
+	page_size = 10
+	pages = 10
+
+	def do_POST(self):
+		length = int(self.headers.get("Content-Length", 0))
+		request = json.loads(self.rfile.read(length) or b"{}")
+		offset = int(request.get("offset") or 0)
+
+		body = json.dumps(make_page(self.page_size, offset, self.pages)).encode()
+		self.send_response(200)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
+
+
+def start_stub_server(
+	page_size: int = 10, pages: int = 10, handler: Optional[type] = None
+) -> ThreadingHTTPServer:
+	"""Start the stub on a free local port in a daemon thread and return the server."""
+	handler = type(
+		"Handler", (handler or StubAdminHandler,), {"page_size": page_size, "pages": pages}
+	)
+	server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server
+
+
+def base_url(server: ThreadingHTTPServer) -> str:
+	host, port = server.server_address[:2]
+	return f"http://{host}:{port}/api/method/"